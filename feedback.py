@@ -1,29 +1,19 @@
-﻿import time, secrets
-from typing import Optional
+﻿from typing import Optional
 from fastapi import APIRouter
 from pydantic import BaseModel
-from helpers.turnstile import verify_turnstile
+from helpers import captcha
+from helpers.turnstile import turnstile_verdict
 
 router = APIRouter()
 
-_MATH = {}
+# Math fallback uses the shared stateless captcha: the id carries a, b, ts and a signed nonce,
+# so there is no per-process challenge store to grow or to lose across workers.
 def _math_new():
-    cid = secrets.token_hex(8)
-    a = secrets.randbelow(8) + 2
-    b = secrets.randbelow(8) + 2
-    _MATH[cid] = {"ans": a + b, "ts": time.time()}
-    return cid, a, b
+    a, b, ts, token = captcha.issue()
+    return captcha.pack_id(a, b, ts, token), a, b
 
 def _math_check(cid: str, ans: int) -> bool:
-    rec = _MATH.pop(cid, None)
-    if not rec:
-        return False
-    if time.time() - rec["ts"] > 300:
-        return False
-    try:
-        return int(ans) == int(rec["ans"])
-    except Exception:
-        return False
+    return captcha.verify_id(cid, ans) == captcha.OK
 
 class FeedbackIn(BaseModel):
     message: str
@@ -46,11 +36,12 @@ async def feedback_submit(data: FeedbackIn):
     used = "none"
     ok = False
     if data.turnstile_token:
-        try:
-            if await verify_turnstile(data.turnstile_token, None):
-                ok, used = True, "turnstile"
-        except Exception:
-            ok = False
+        verdict = await turnstile_verdict(data.turnstile_token, None)
+        if verdict:
+            ok, used = True, "turnstile"
+        elif verdict is None:
+            # Turnstile slow or down: don't make the user wait on it, ask for the math challenge instead
+            used = "turnstile_unavailable"
     if not ok and data.math_challenge_id and data.math_answer is not None:
         if _math_check(data.math_challenge_id, data.math_answer):
             ok, used = True, "math"
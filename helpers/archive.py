@@ -0,0 +1,291 @@
+import argparse, asyncio, json, os, struct, sys, time, zlib
+from array import array
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from helpers import storage
+
+try:
+    import fcntl
+except ImportError:  # Windows dev boxes: no cross-process lock, the manifest check still applies
+    fcntl = None
+
+# Columnar archive for old scan rows. A periodic compaction moves scans older than ARCHIVE_AFTER_DAYS
+# out of the hot table into immutable files of up to ARCHIVE_FILE_ROWS rows, one zlib block per column:
+#   id          delta-encoded varints (rows are in id order)
+#   created_at  zigzag delta varints
+#   status, ip  dictionary-encoded: value list + array of codes
+#   email_hash  raw 32-byte digests (newline-joined text if any value is not a sha256 hex digest)
+# Layout: MAGIC | uint32 header length | JSON header {rows, min/max id/ts, columns: {name: blocks}} | blocks.
+# Analytical reads (counts by day/status) decompress only the created_at and status blocks. Files are
+# listed in the archive_files table in the same transaction that deletes their rows; anything else in
+# ARCHIVE_DIR (including *.tmp files) is a leftover from an interrupted run and is ignored, then
+# removed. Every worker schedules compaction, but an flock on ARCHIVE_DIR/.compact.lock lets only one
+# of them run it at a time; the others skip that round.
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", "./archive")).resolve()
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))  # 0 disables compaction
+ARCHIVE_INTERVAL_SEC = float(os.getenv("ARCHIVE_INTERVAL_SEC", "21600"))
+ARCHIVE_FILE_ROWS = int(os.getenv("ARCHIVE_FILE_ROWS", "100000"))
+MAGIC = b"ESCOL001"
+_LEN = struct.Struct("<I")
+_ORPHAN_GRACE_SEC = 3600
+
+# ---- encodings ----
+def _varints(values: Sequence[int]) -> bytes:
+    out = bytearray()
+    for v in values:
+        while v >= 0x80:
+            out.append((v & 0x7F) | 0x80)
+            v >>= 7
+        out.append(v)
+    return bytes(out)
+
+def _unvarints(data: bytes) -> List[int]:
+    out, v, shift = [], 0, 0
+    for b in data:
+        v |= (b & 0x7F) << shift
+        if b & 0x80:
+            shift += 7
+        else:
+            out.append(v)
+            v, shift = 0, 0
+    return out
+
+def _delta(values: Sequence[int]) -> bytes:
+    prev, zz = 0, []
+    for v in values:
+        d, prev = v - prev, v
+        zz.append((d << 1) ^ (d >> 63))  # zigzag: small negative deltas stay small
+    return _varints(zz)
+
+def _undelta(data: bytes) -> List[int]:
+    out, prev = [], 0
+    for z in _unvarints(data):
+        prev += (z >> 1) ^ -(z & 1)
+        out.append(prev)
+    return out
+
+def _hashes(values: Sequence[str]) -> Tuple[str, bytes]:
+    try:
+        if all(len(v) == 64 and v == v.lower() for v in values):
+            return "hex32", b"".join(bytes.fromhex(v) for v in values)
+    except ValueError:
+        pass
+    return "text", "\n".join(values).encode()
+
+def _dict_encode(values: Sequence[str]) -> Tuple[List[str], array]:
+    index: Dict[str, int] = {}
+    codes = array("I", (index.setdefault(v, len(index)) for v in values))
+    if len(index) < 1 << 16:
+        codes = array("H", codes)
+    return list(index), codes
+
+# ---- file format ----
+def write_file(path: Path, cols: Dict[str, list]) -> int:
+    # cols: id, email_hash, status, ip, created_at (parallel lists, id ascending)
+    hash_enc, hash_block = _hashes(cols["email_hash"])
+    blocks: List[Tuple[str, bytes]] = [
+        ("id", _delta(cols["id"])),
+        ("created_at", _delta(cols["created_at"])),
+        ("email_hash", hash_block),
+    ]
+    typecodes = {}
+    for name in ("status", "ip"):
+        values, codes = _dict_encode(cols[name])
+        blocks.append((f"{name}.values", "\n".join(values).encode()))
+        blocks.append((f"{name}.codes", codes.tobytes()))
+        typecodes[name] = codes.typecode
+    offset, layout, payload = 0, {}, []
+    for name, raw in blocks:
+        z = zlib.compress(raw, 9)
+        layout[name] = [offset, len(z)]
+        payload.append(z)
+        offset += len(z)
+    ts = cols["created_at"]
+    header = json.dumps({
+        "rows": len(cols["id"]), "min_id": cols["id"][0], "max_id": cols["id"][-1],
+        "min_ts": min(ts), "max_ts": max(ts), "blocks": layout, "typecodes": typecodes, "email_hash": hash_enc,
+    }).encode()
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp.open("wb") as f:
+        f.write(MAGIC + _LEN.pack(len(header)) + header)
+        for z in payload:
+            f.write(z)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return path.stat().st_size
+
+class ArchiveFile:
+    def __init__(self, path: Path):
+        self.path = path
+        with path.open("rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path}: not an archive file")
+            (n,) = _LEN.unpack(f.read(_LEN.size))
+            self.header = json.loads(f.read(n))
+        self._base = len(MAGIC) + _LEN.size + n
+
+    def _block(self, f, name: str) -> bytes:
+        off, size = self.header["blocks"][name]
+        f.seek(self._base + off)
+        return zlib.decompress(f.read(size))
+
+    def columns(self, names: Sequence[str]) -> Dict[str, list]:
+        # Decompresses only the requested columns
+        out: Dict[str, list] = {}
+        with self.path.open("rb") as f:
+            for name in names:
+                if name in ("id", "created_at"):
+                    out[name] = _undelta(self._block(f, name))
+                elif name == "email_hash":
+                    raw = self._block(f, name)
+                    if self.header["email_hash"] == "hex32":
+                        out[name] = [raw[i:i + 32].hex() for i in range(0, len(raw), 32)]
+                    else:
+                        out[name] = raw.decode().split("\n")
+                else:
+                    values = self._block(f, f"{name}.values").decode().split("\n")
+                    codes = array(self.header["typecodes"][name])
+                    codes.frombytes(self._block(f, f"{name}.codes"))
+                    out[name] = [values[c] for c in codes]
+        return out
+
+# ---- manifest ----
+def _manifest(kind: str, since: Optional[int] = None, until: Optional[int] = None,
+              after_id: int = 0) -> List[Tuple[str, int]]:
+    # (name, rows) of archive files overlapping [since, until) with ids above after_id, oldest first
+    sql = "SELECT name, rows FROM archive_files WHERE kind = ? AND max_id > ?"
+    args: list = [kind, after_id]
+    if since is not None:
+        sql += " AND max_ts >= ?"
+        args.append(since)
+    if until is not None:
+        sql += " AND min_ts < ?"
+        args.append(until)
+    with storage.reader() as con:
+        return con.execute(sql + " ORDER BY min_id", args).fetchall()
+
+# ---- compaction ----
+def _try_lock():
+    # Open lock file descriptor, or None if another process is compacting
+    fd = os.open(ARCHIVE_DIR / ".compact.lock", os.O_RDWR | os.O_CREAT, 0o600)
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+    return fd
+
+def compact(after_days: int = ARCHIVE_AFTER_DAYS, file_rows: int = ARCHIVE_FILE_ROWS) -> int:
+    # Moves scans older than after_days into archive files; returns the number of rows moved
+    # (0 if another process holds the compaction lock)
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    fd = _try_lock()
+    if fd is None:
+        return 0
+    try:
+        return _compact(int(time.time()) - after_days * 86400, file_rows)
+    finally:
+        os.close(fd)  # releases the flock
+
+def _compact(cutoff: int, file_rows: int) -> int:
+    _remove_orphans()
+    moved = 0
+    while True:
+        with storage.reader() as con:
+            rows = con.execute(
+                "SELECT id, email_hash, status, ip, created_at FROM scans WHERE created_at < ? ORDER BY id LIMIT ?",
+                (cutoff, file_rows),
+            ).fetchall()
+        if not rows:
+            return moved
+        cols = {name: [r[i] for r in rows] for i, name in enumerate(("id", "email_hash", "status", "ip", "created_at"))}
+        lo, hi = cols["id"][0], cols["id"][-1]
+        name = f"scans-{lo:012d}-{hi:012d}.col"
+        size = write_file(ARCHIVE_DIR / name, cols)
+        with storage.writer() as con:
+            with con:
+                clash = con.execute(
+                    "SELECT 1 FROM archive_files WHERE kind = 'scans' AND max_id >= ? AND min_id <= ?", (lo, hi)).fetchone()
+                if clash:
+                    # Archived (part of) this range some other way, e.g. a run without the lock
+                    (ARCHIVE_DIR / name).unlink(missing_ok=True)
+                    return moved
+                con.execute(
+                    "INSERT INTO archive_files (name, kind, min_id, max_id, min_ts, max_ts, rows, bytes, created_at)"
+                    " VALUES (?, 'scans', ?, ?, ?, ?, ?, ?, ?)",
+                    (name, lo, hi, min(cols["created_at"]), max(cols["created_at"]), len(rows), size, int(time.time())),
+                )
+                # Same predicate as the SELECT, so exactly the archived rows go
+                con.execute("DELETE FROM scans WHERE id BETWEEN ? AND ? AND created_at < ?", (lo, hi, cutoff))
+        moved += len(rows)
+        print(f"[INFO] archived {len(rows):,} scans into {name} ({size:,} bytes)")
+
+def _remove_orphans() -> None:
+    with storage.reader() as con:
+        listed = {n for (n,) in con.execute("SELECT name FROM archive_files")}
+    now = time.time()
+    for pattern in ("*.col", "*.tmp"):
+        for p in ARCHIVE_DIR.glob(pattern):
+            if p.name not in listed and now - p.stat().st_mtime > _ORPHAN_GRACE_SEC:
+                p.unlink(missing_ok=True)
+
+async def run_periodically(interval: float = ARCHIVE_INTERVAL_SEC) -> None:
+    if ARCHIVE_AFTER_DAYS <= 0:
+        return
+    while True:
+        try:
+            await asyncio.to_thread(compact)
+        except Exception as e:
+            print(f"[WARN] archive compaction failed: {e!r}")
+        await asyncio.sleep(interval)
+
+# ---- queries ----
+def counts(since: Optional[int] = None, until: Optional[int] = None) -> Counter:
+    # Counter of (YYYY-MM-DD, status) -> rows over archived scans, reading two columns per file
+    out: Counter = Counter()
+    for name, _ in _manifest("scans", since, until):
+        cols = ArchiveFile(ARCHIVE_DIR / name).columns(("created_at", "status"))
+        days: Dict[int, str] = {}
+        for ts, status in zip(cols["created_at"], cols["status"]):
+            if (since is not None and ts < since) or (until is not None and ts >= until):
+                continue
+            d = ts // 86400
+            if d not in days:
+                days[d] = datetime.fromtimestamp(d * 86400, timezone.utc).date().isoformat()
+            out[(days[d], status)] += 1
+    return out
+
+def iter_batches(since: Optional[int] = None, until: Optional[int] = None, after_id: int = 0,
+                 max_id: Optional[int] = None) -> Iterator[List[tuple]]:
+    # Archived scans as (id, email_hash, status, ip, created_at) rows with after_id < id <= max_id,
+    # id ascending, one file per batch
+    for name, _ in _manifest("scans", since, until, after_id):
+        cols = ArchiveFile(ARCHIVE_DIR / name).columns(("id", "email_hash", "status", "ip", "created_at"))
+        rows = [
+            r for r in zip(cols["id"], cols["email_hash"], cols["status"], cols["ip"], cols["created_at"])
+            if r[0] > after_id and (max_id is None or r[0] <= max_id)
+            and (since is None or r[4] >= since) and (until is None or r[4] < until)
+        ]
+        if rows:
+            yield rows
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m helpers.archive")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("compact", help="move old scans into columnar archive files")
+    c.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS)
+    sub.add_parser("counts", help="print archived scans per day and status")
+    args = ap.parse_args(argv)
+    if args.cmd == "compact":
+        print(f"moved {compact(args.days):,} rows")
+    else:
+        for (day, status), n in sorted(counts().items()):
+            print(f"{day}\t{status}\t{n}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
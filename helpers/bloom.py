@@ -0,0 +1,45 @@
+﻿import hashlib, math
+from typing import Optional
+
+def _params(capacity: int, error_rate: float):
+    capacity = max(1, capacity)
+    m = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+    return m, max(1, int(round(m / capacity * math.log(2))))
+
+class BloomFilter:
+    # Fixed-size bit array; `buf` may be any writable buffer (bytearray, mmap) so callers can share it
+    __slots__ = ("bits", "m", "k")
+
+    def __init__(self, capacity: int, error_rate: float = 0.01, buf: Optional[bytearray] = None):
+        self.m, self.k = _params(capacity, error_rate)
+        self.bits = buf if buf is not None else bytearray((self.m + 7) // 8)
+        if len(self.bits) * 8 < self.m:
+            raise ValueError(f"buffer too small for {self.m} bits")
+
+    @staticmethod
+    def size_for(capacity: int, error_rate: float = 0.01) -> int:
+        return (_params(capacity, error_rate)[0] + 7) // 8
+
+    def _positions(self, item: bytes):
+        # Kirsch-Mitzenmacher double hashing from one 128-bit digest
+        d = hashlib.blake2b(item, digest_size=16).digest()
+        h1, h2 = int.from_bytes(d[:8], "little"), int.from_bytes(d[8:], "little") | 1
+        m = self.m
+        return ((h1 + i * h2) % m for i in range(self.k))
+
+    def add(self, item: bytes) -> bool:
+        # Returns True if the item was (probably) already present
+        bits, seen = self.bits, True
+        for p in self._positions(item):
+            byte, mask = p >> 3, 1 << (p & 7)
+            if not bits[byte] & mask:
+                seen = False
+                bits[byte] |= mask
+        return seen
+
+    def __contains__(self, item: bytes) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def clear(self) -> None:
+        self.bits[:] = bytes(len(self.bits))
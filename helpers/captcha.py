@@ -0,0 +1,186 @@
+﻿import hashlib, hmac, mmap, os, secrets, struct, tempfile, threading, time
+from contextlib import contextmanager
+from typing import Dict, Tuple
+from helpers.bloom import BloomFilter
+from helpers.metrics import CAPTCHA_CHECKS, CAPTCHA_REPLAY_FILL, CAPTCHA_REPLAY_ROTATIONS
+from helpers.ratelimit import RATE_LIMIT_REDIS_URL, RedisBackend
+
+try:
+    import fcntl
+except ImportError:  # Windows dev boxes: replay filter stays per process
+    fcntl = None
+
+# Stateless math captcha: everything needed to verify travels in the signed token, so any worker
+# (or replica sharing FEEDBACK_SECRET) can check its signature. Replays within the TTL are caught by a
+# pair of fixed-size Bloom filters of spent nonces that rotate every replay period (the longest TTL):
+# a nonce spent in generation g is remembered through g+1, which always outlives the token itself.
+# The filters live in a file shared by the workers of one host only, so with N replicas a solved
+# challenge can be replayed once per replica; CAPTCHA_REPLAY_BACKEND=redis keeps the spent nonces
+# in Redis instead (one SET NX per check), falling back to the local filters while it is unreachable.
+SECRET = os.getenv("FEEDBACK_SECRET", "dev-secret-change-me").encode()
+CAPTCHA_TTL_SEC = int(os.getenv("CAPTCHA_TTL_SEC", "180"))  # main.py /feedback
+CAPTCHA_FALLBACK_TTL_SEC = int(os.getenv("CAPTCHA_FALLBACK_TTL_SEC", "300"))  # feedback.py math fallback
+_REPLAY_PERIOD = max(CAPTCHA_TTL_SEC, CAPTCHA_FALLBACK_TTL_SEC)
+CAPTCHA_SKEW_SEC = 30  # tolerated clock skew for ts in the future
+CAPTCHA_REPLAY_CAPACITY = int(os.getenv("CAPTCHA_REPLAY_CAPACITY", "200000"))  # spent nonces per generation
+CAPTCHA_REPLAY_PATH = os.getenv("CAPTCHA_REPLAY_PATH") or os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "exposureshield-captcha")
+CAPTCHA_REPLAY_BACKEND = os.getenv("CAPTCHA_REPLAY_BACKEND", "local").lower()
+CAPTCHA_REPLAY_REDIS_URL = os.getenv("CAPTCHA_REPLAY_REDIS_URL", RATE_LIMIT_REDIS_URL)
+
+OK, INVALID, EXPIRED, REPLAYED, WRONG = "ok", "invalid", "expired", "replayed", "wrong"
+
+class _ReplayFilter:
+    # File layout: header (uint64 rotation sequence, float64 rotated_at, uint64 nonces in the current
+    # filter), then the two bit arrays; the current filter is sequence % 2. flock guards check-and-set
+    # and rotation across processes; without fcntl everything lives in a private bytearray.
+    # Filters rotate every replay period, or early once the current one holds `capacity` nonces: past
+    # that its false-positive rate climbs until every fresh nonce reads as spent, which a flood of
+    # (free) challenges could use to lock out all feedback. Rotating early instead forgets the older
+    # generation sooner, so a flood weakens replay protection rather than blocking real users.
+    _HEAD = struct.Struct("<QdQ")
+
+    def __init__(self, capacity: int, path: str):
+        self.capacity = max(1, capacity)
+        self._nbytes = BloomFilter.size_for(capacity, 0.001)
+        size = self._HEAD.size + 2 * self._nbytes
+        self._fd = None
+        if fcntl is not None:
+            try:
+                self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+                with self._locked():
+                    if os.fstat(self._fd).st_size != size:
+                        os.ftruncate(self._fd, 0)
+                        os.ftruncate(self._fd, size)
+                self._buf = mmap.mmap(self._fd, size)
+            except OSError as e:
+                print(f"[WARN] captcha replay filter not shared ({e}); using per-process memory")
+                self._fd = None
+        if self._fd is None:
+            self._buf = bytearray(size)
+        view = memoryview(self._buf)
+        off = self._HEAD.size
+        self._filters = (
+            BloomFilter(capacity, 0.001, buf=view[off:off + self._nbytes]),
+            BloomFilter(capacity, 0.001, buf=view[off + self._nbytes:off + 2 * self._nbytes]),
+        )
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        if self._fd is None:
+            yield
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def spend(self, nonce: bytes, now: float) -> bool:
+        # True if the nonce was fresh (and is now marked spent), False if it was seen before
+        with self._lock, self._locked():
+            seq, rotated_at, count = self._HEAD.unpack_from(self._buf, 0)
+            age = now - rotated_at
+            if age >= _REPLAY_PERIOD or count >= self.capacity:
+                CAPTCHA_REPLAY_ROTATIONS.labels("period" if age >= _REPLAY_PERIOD else "full").inc()
+                if age >= 2 * _REPLAY_PERIOD:
+                    self._filters[seq % 2].clear()  # nothing in it can still be valid
+                seq, rotated_at, count = seq + 1, now, 0
+                self._filters[seq % 2].clear()
+            cur, prev = self._filters[seq % 2], self._filters[(seq - 1) % 2]
+            fresh = nonce not in prev and not cur.add(nonce)
+            if fresh:
+                count += 1
+            self._HEAD.pack_into(self._buf, 0, seq, rotated_at, count)
+        CAPTCHA_REPLAY_FILL.set(count / self.capacity)
+        return fresh
+
+    def fill(self) -> float:
+        # Nonces in the current filter as a fraction of its capacity (rotation happens at 1.0)
+        return self._HEAD.unpack_from(self._buf, 0)[2] / self.capacity
+
+class _RedisReplay:
+    # Spent nonces as Redis keys that expire with the replay period: exact and shared by every
+    # replica. A Redis failure falls back to the host-local filters rather than refusing feedback.
+    def __init__(self, url: str, local: _ReplayFilter):
+        self._redis = RedisBackend(url)
+        self._local = local
+
+    def spend(self, nonce: bytes, now: float) -> bool:
+        try:
+            return self._redis.set_once("captcha:" + nonce.decode(), _REPLAY_PERIOD + CAPTCHA_SKEW_SEC)
+        except (OSError, RuntimeError, ConnectionError) as e:
+            print(f"[WARN] captcha replay backend failed, using the local filter: {e!r}")
+            return self._local.spend(nonce, now)
+
+    def fill(self) -> float:
+        return self._local.fill()
+
+_FILTER = None
+_FILTER_LOCK = threading.Lock()
+_COUNTS = {"issued": 0, OK: 0, INVALID: 0, EXPIRED: 0, REPLAYED: 0, WRONG: 0}
+
+def _filter():
+    global _FILTER
+    if _FILTER is None:
+        with _FILTER_LOCK:
+            if _FILTER is None:
+                local = _ReplayFilter(CAPTCHA_REPLAY_CAPACITY, CAPTCHA_REPLAY_PATH)
+                _FILTER = _RedisReplay(CAPTCHA_REPLAY_REDIS_URL, local) if CAPTCHA_REPLAY_BACKEND == "redis" else local
+    return _FILTER
+
+def _sign(a: int, b: int, ts: int, nonce: str) -> str:
+    return hmac.new(SECRET, f"math|{a}|{b}|{ts}|{nonce}".encode(), hashlib.sha256).hexdigest()
+
+def issue() -> Tuple[int, int, int, str]:
+    # Returns (a, b, ts, token); the token is "<nonce>.<hmac>" and is opaque to clients
+    a = secrets.randbelow(8) + 2
+    b = secrets.randbelow(8) + 2
+    ts = int(time.time())
+    nonce = secrets.token_hex(8)
+    _COUNTS["issued"] += 1
+    return a, b, ts, f"{nonce}.{_sign(a, b, ts, nonce)}"
+
+def _verify(a: int, b: int, ts: int, token: str, answer, ttl: int) -> str:
+    nonce, _, sig = str(token).partition(".")
+    try:
+        a, b, ts = int(a), int(b), int(ts)
+    except (TypeError, ValueError):
+        return INVALID
+    if not nonce or not hmac.compare_digest(_sign(a, b, ts, nonce), sig):
+        return INVALID
+    now = time.time()
+    if ts > now + CAPTCHA_SKEW_SEC or now - ts > min(ttl, _REPLAY_PERIOD):
+        return EXPIRED
+    # Burn the nonce on any authentic attempt, right or wrong, so answers cannot be brute-forced
+    if not _filter().spend(nonce.encode(), now):
+        return REPLAYED
+    try:
+        return OK if int(answer) == a + b else WRONG
+    except (TypeError, ValueError):
+        return WRONG
+
+def verify(a: int, b: int, ts: int, token: str, answer, ttl: int = CAPTCHA_TTL_SEC) -> str:
+    status = _verify(a, b, ts, token, answer, ttl)
+    _COUNTS[status] += 1
+    CAPTCHA_CHECKS.labels(status).inc()
+    return status
+
+def pack_id(a: int, b: int, ts: int, token: str) -> str:
+    # Single opaque id for clients that only echo an id + answer (feedback.py's math fallback)
+    return f"{a}.{b}.{ts}.{token}"
+
+def verify_id(cid: str, answer, ttl: int = CAPTCHA_FALLBACK_TTL_SEC) -> str:
+    parts = str(cid).split(".", 3)
+    if len(parts) != 4:
+        _COUNTS[INVALID] += 1
+        CAPTCHA_CHECKS.labels(INVALID).inc()
+        return INVALID
+    return verify(parts[0], parts[1], parts[2], parts[3], answer, ttl)
+
+def replay_fill() -> float:
+    return _filter().fill()
+
+def stats() -> Dict[str, float]:
+    return {**_COUNTS, "replay_filter_fill": round(replay_fill(), 6)}
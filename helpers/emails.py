@@ -0,0 +1,59 @@
+import hashlib, hmac, os
+from collections import OrderedDict
+from typing import Union
+
+# One normalisation for every place an address is keyed (dataset index, HIBP cache, scan log), and
+# each keyed hash computed at most once per address: the keyed prefixes are absorbed into hash
+# objects once at import and each digest starts from a .copy() of them. Recent addresses are kept in
+# a bounded LRU, so a burst of scans or retries for the same address hashes nothing at all.
+EMAIL_CACHE_MAX = int(os.getenv("EMAIL_CACHE_MAX", "4096"))
+_SECRET = os.getenv("FEEDBACK_SECRET", "dev-secret-change-me")
+_SALT = (os.getenv("HIBP_CACHE_SALT") or _SECRET).encode()
+
+# scans.email_hash has always been sha256(SECRET + "|" + email); keep it so history stays joinable
+_SCAN_PREFIX = hashlib.sha256((_SECRET + "|").encode())
+_CACHE_PREFIX = hmac.new(_SALT, digestmod=hashlib.sha256)
+
+def normalize_text(email: str) -> str:
+    return email.strip().lower()
+
+class NormalizedEmail(str):
+    # A str (so it drops into any API taking an address) that carries its split parts and lazily
+    # computed digests; build it with normalize()
+    local: str
+    domain: str
+
+    @property
+    def scan_hash(self) -> str:
+        h = self.__dict__.get("_scan_hash")
+        if h is None:
+            d = _SCAN_PREFIX.copy()
+            d.update(self.encode())
+            h = self.__dict__["_scan_hash"] = d.hexdigest()
+        return h
+
+    @property
+    def cache_key(self) -> str:
+        # Salted HMAC for the shared HIBP cache table; never a plain or trivially reversible address
+        h = self.__dict__.get("_cache_key")
+        if h is None:
+            d = _CACHE_PREFIX.copy()
+            d.update(self.encode())
+            h = self.__dict__["_cache_key"] = d.hexdigest()
+        return h
+
+_LRU: "OrderedDict[str, NormalizedEmail]" = OrderedDict()
+
+def normalize(email: Union[str, NormalizedEmail]) -> NormalizedEmail:
+    if isinstance(email, NormalizedEmail):
+        return email
+    hit = _LRU.get(email)
+    if hit is not None:
+        _LRU.move_to_end(email)
+        return hit
+    ne = NormalizedEmail(normalize_text(email))
+    ne.local, _, ne.domain = ne.rpartition("@")
+    _LRU[email] = ne
+    if len(_LRU) > EMAIL_CACHE_MAX:
+        _LRU.popitem(last=False)
+    return ne
@@ -0,0 +1,140 @@
+import asyncio, csv, io, json, zlib
+from typing import AsyncIterator, Iterator, List, Optional, Sequence, Tuple
+from helpers import archive, storage
+from helpers.filestore import SegmentStore
+from helpers.migrations import iso_to_epoch
+from helpers.persist import COLUMNS, epoch_iso
+
+# Admin exports stream oldest first in both store modes. In sqlite mode rows come in keyset-paginated
+# batches (WHERE id > last ORDER BY id LIMIT n), each on a pooled reader held only for that batch, so
+# memory stays flat and no read transaction pins the WAL for the length of a multi-million-row
+# download. Ids are capped at the table's MAX(id) when the export starts, so rows written meanwhile
+# do not stretch it out. A since/until range is first turned into an id range through the created_at
+# index, so a recent window does not walk the primary key from the first row.
+EXPORT_BATCH = 5000
+FORMATS = ("csv", "ndjson", "json")
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson", "json": "application/json"}
+
+def parse_time(value: Optional[str]) -> Optional[int]:
+    # Epoch seconds or an ISO date/datetime (UTC unless an offset is given)
+    if value is None or value == "":
+        return None
+    if value.isdigit():
+        return int(value)
+    ts = iso_to_epoch(value)
+    if ts is None:
+        raise ValueError(f"bad timestamp {value!r}")
+    return ts
+
+def _id_range(table: str, since: Optional[int], until: Optional[int]) -> Tuple[int, int, int]:
+    # (max_id, after, upper): the table's MAX(id) at export start, and the id range of its rows in
+    # [since, until). "+id" turns off SQLite's min/max shortcut, which would walk the primary key from
+    # the first row, so both lookups are idx_*_created_at covering-index range scans.
+    with storage.reader() as con:
+        max_id = con.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+        after, upper = 0, max_id
+        if since is not None:
+            first = con.execute(f"SELECT MIN(+id) FROM {table} WHERE created_at >= ?", (since,)).fetchone()[0]
+            after = max_id if first is None else first - 1
+        if until is not None:
+            last = con.execute(f"SELECT MAX(+id) FROM {table} WHERE created_at < ?", (until,)).fetchone()[0]
+            upper = min(upper, last or 0)
+    return max_id, after, upper
+
+def _sqlite_batch(table: str, after: int, upper: int, since: Optional[int], until: Optional[int]) -> List[tuple]:
+    cols = COLUMNS[table]
+    where, args = ["id > ?", "id <= ?"], [after, upper]
+    if since is not None:
+        where.append("created_at >= ?")
+        args.append(since)
+    if until is not None:
+        where.append("created_at < ?")
+        args.append(until)
+    sql = f"SELECT id, {', '.join(cols)} FROM {table} WHERE {' AND '.join(where)} ORDER BY id LIMIT {EXPORT_BATCH}"
+    with storage.reader() as con:
+        return con.execute(sql, args).fetchall()
+
+async def _sqlite_rows(table: str, since: Optional[int], until: Optional[int]) -> AsyncIterator[List[tuple]]:
+    # The seeded range only covers the hot table; archived scans are found through the manifest's
+    # time bounds and capped at the starting MAX(id)
+    upper, hot_after, hot_upper = await asyncio.to_thread(_id_range, table, since, until)
+    after = 0
+    while True:
+        if table == "scans":
+            # Older scans live in the columnar archive (lower ids), one file per batch. Checked again
+            # before every hot-table batch, so rows compacted mid-export are neither lost nor reordered.
+            async for rows in _iter_async(archive.iter_batches(since, until, after, upper)):
+                after = rows[-1][0]
+                yield [r[1:] for r in rows]
+        after = max(after, hot_after)
+        rows = await asyncio.to_thread(_sqlite_batch, table, after, hot_upper, since, until)
+        if rows:
+            after = rows[-1][0]
+            yield [r[1:] for r in rows]
+        if len(rows) < EXPORT_BATCH:
+            break
+
+async def _iter_async(it: Iterator[List[tuple]]) -> AsyncIterator[List[tuple]]:
+    while True:
+        batch = await asyncio.to_thread(next, it, None)
+        if batch is None:
+            return
+        yield batch
+
+def _file_batches(store: SegmentStore, table: str, since: Optional[int], until: Optional[int]) -> Iterator[List[tuple]]:
+    cols = COLUMNS[table]
+    batch: List[tuple] = []
+    for obj, ts in store.iter_records(since, until):
+        batch.append(tuple(obj.get(c, "") for c in cols[:-1]) + (ts,))
+        if len(batch) >= EXPORT_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _file_rows(store: SegmentStore, table: str, since: Optional[int], until: Optional[int]) -> AsyncIterator[List[tuple]]:
+    return _iter_async(_file_batches(store, table, since, until))
+
+def _encode(fmt: str, cols: Sequence[str], rows: List[tuple], first: bool) -> str:
+    rows = [r[:-1] + (epoch_iso(r[-1]),) for r in rows]
+    if fmt == "csv":
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        return buf.getvalue()
+    objs = (json.dumps(dict(zip(cols, r)), ensure_ascii=False) for r in rows)
+    if fmt == "ndjson":
+        return "".join(o + "\n" for o in objs)
+    return ("" if first else ",") + ",".join(objs)
+
+def _framing(fmt: str, cols: Sequence[str]) -> Tuple[str, str]:
+    if fmt == "csv":
+        return ",".join(cols) + "\r\n", ""
+    if fmt == "json":
+        return "[", "]"
+    return "", ""
+
+async def stream(table: str, fmt: str, since: Optional[int] = None, until: Optional[int] = None,
+                 file_store: Optional[SegmentStore] = None, gzip: bool = False) -> AsyncIterator[bytes]:
+    # file_store selects file mode (segmented NDJSON); otherwise rows come from the sqlite table
+    cols = COLUMNS[table]
+    head, tail = _framing(fmt, cols)
+    z = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None  # wbits=31: gzip container
+
+    def out(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return z.compress(data) if z else data
+
+    if head:
+        yield out(head)
+    batches = _file_rows(file_store, table, since, until) if file_store else _sqlite_rows(table, since, until)
+    first = True
+    async for rows in batches:
+        chunk = out(_encode(fmt, cols, rows, first))
+        first = False
+        if chunk:
+            yield chunk
+    tail_bytes = out(tail) if tail else b""
+    if z:
+        tail_bytes += z.flush()
+    if tail_bytes:
+        yield tail_bytes
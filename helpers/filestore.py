@@ -0,0 +1,188 @@
+import heapq, json, os, threading
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from helpers.migrations import iso_to_epoch
+
+# STORE_MODE=file engine: each kind is a directory of append-only NDJSON segments
+#   <LOG_DIR>/<kind>/<kind>-<YYYYMMDD>-<pid>-<seq>.ndjson
+# A writer keeps one buffered append handle open and rotates to a new segment when the UTC day
+# changes or the segment passes FILESTORE_SEGMENT_MB. Sealing a segment writes a sidecar
+# <segment>.idx.json with its row count, min/max created_at and rows per day, so metrics are answered
+# from sidecars alone and exports skip segments outside the requested range. Segment names carry
+# the pid, so uvicorn workers never share a file or race on an index.
+LOG_DIR = Path(os.getenv("LOG_DIR", "./logs")).resolve()
+FILESTORE_SEGMENT_MB = float(os.getenv("FILESTORE_SEGMENT_MB", "64"))
+FILESTORE_FSYNC = os.getenv("FILESTORE_FSYNC", "0") == "1"
+_BUFFER = 1 << 16
+
+def _day(ts: int) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y%m%d")
+
+def _iso_day(day: str) -> str:
+    return f"{day[:4]}-{day[4:6]}-{day[6:]}"
+
+class _Meta:
+    __slots__ = ("rows", "min_ts", "max_ts", "days")
+
+    def __init__(self, rows: int = 0, min_ts: Optional[int] = None, max_ts: Optional[int] = None,
+                 days: Optional[Dict[str, int]] = None):
+        self.rows, self.min_ts, self.max_ts = rows, min_ts, max_ts
+        self.days: Counter = Counter(days or {})
+
+    def add(self, ts: int) -> None:
+        self.rows += 1
+        self.min_ts = ts if self.min_ts is None else min(self.min_ts, ts)
+        self.max_ts = ts if self.max_ts is None else max(self.max_ts, ts)
+        self.days[_iso_day(_day(ts))] += 1
+
+    def overlaps(self, since: Optional[int], until: Optional[int]) -> bool:
+        if self.rows == 0:
+            return False
+        return (since is None or self.max_ts >= since) and (until is None or self.min_ts < until)
+
+    def to_json(self) -> Dict:
+        return {"rows": self.rows, "min_ts": self.min_ts, "max_ts": self.max_ts, "days": dict(self.days)}
+
+def _scan(path: Path) -> _Meta:
+    meta = _Meta()
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                meta.add(iso_to_epoch(json.loads(line).get("created_at")) or 0)
+            except ValueError:
+                continue
+    return meta
+
+def _sidecar(path: Path) -> Path:
+    return path.with_name(path.name + ".idx.json")
+
+class SegmentStore:
+    def __init__(self, kind: str, root: Path = LOG_DIR, legacy: Optional[Path] = None):
+        self.kind = kind
+        self.dir = root / kind
+        self.legacy = legacy  # pre-segment single NDJSON file, read (never written) if present
+        self.max_bytes = int(FILESTORE_SEGMENT_MB * (1 << 20))
+        self._lock = threading.Lock()
+        self._f = None
+        self._path: Optional[Path] = None
+        self._day: Optional[str] = None
+        self._size = 0  # bytes written to the open segment; tell() on a text handle would flush per row
+        self._meta = _Meta()
+        self._seq = 0
+        self._scanned: Dict[Path, Tuple[int, int, _Meta]] = {}  # unsealed segment -> (size, mtime_ns, meta)
+
+    # ---- writing ----
+    def _open(self, day: str) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        while True:
+            self._seq += 1
+            path = self.dir / f"{self.kind}-{day}-{os.getpid()}-{self._seq:04d}.ndjson"
+            if not path.exists():
+                break
+        self._f = path.open("a", encoding="utf-8", buffering=_BUFFER)
+        self._path, self._day, self._meta, self._size = path, day, _Meta(), 0
+
+    def _seal(self) -> None:
+        if self._f is None:
+            return
+        self._f.close()
+        tmp = _sidecar(self._path).with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._meta.to_json()), encoding="utf-8")
+        os.replace(tmp, _sidecar(self._path))
+        self._f = self._path = self._day = None
+
+    def append(self, records: List[Dict], timestamps: List[int]) -> None:
+        # records are written as-is; timestamps (epoch seconds) drive rotation and the index
+        with self._lock:
+            for rec, ts in zip(records, timestamps):
+                day = _day(ts)
+                if self._f is not None and (day != self._day or self._size >= self.max_bytes):
+                    self._seal()
+                if self._f is None:
+                    self._open(day)
+                line = json.dumps(rec, ensure_ascii=False) + "\n"
+                self._f.write(line)
+                self._size += len(line.encode("utf-8"))
+                self._meta.add(ts)
+            if self._f is not None:
+                self._f.flush()
+                if FILESTORE_FSYNC:
+                    os.fsync(self._f.fileno())
+
+    def close(self) -> None:
+        with self._lock:
+            self._seal()
+
+    # ---- reading ----
+    def _segments(self) -> List[Tuple[Path, _Meta]]:
+        with self._lock:
+            active = self._path
+            if self._f is not None:
+                self._f.flush()
+                active_meta = _Meta(self._meta.rows, self._meta.min_ts, self._meta.max_ts, self._meta.days)
+        out = []
+        paths = sorted(self.dir.glob(f"{self.kind}-*.ndjson")) if self.dir.exists() else []
+        if self.legacy is not None and self.legacy.exists():
+            paths.insert(0, self.legacy)
+        for path in paths:
+            side = _sidecar(path)
+            if path == active:
+                out.append((path, active_meta))
+                continue
+            if side.exists():
+                try:
+                    out.append((path, _Meta(**json.loads(side.read_text(encoding="utf-8")))))
+                    continue
+                except (ValueError, TypeError):
+                    pass
+            # Unsealed (another live worker's, or left by a crash): scan once per size/mtime
+            st = path.stat()
+            hit = self._scanned.get(path)
+            if hit is None or hit[:2] != (st.st_size, st.st_mtime_ns):
+                hit = self._scanned[path] = (st.st_size, st.st_mtime_ns, _scan(path))
+            out.append((path, hit[2]))
+        return out
+
+    def counts(self, dates: List[str]) -> Dict:
+        # Totals and per-day counts from the index; only unsealed segments are read
+        by_day: Counter = Counter()
+        total = 0
+        for _, meta in self._segments():
+            total += meta.rows
+            for d, n in meta.days.items():
+                if d >= dates[0]:
+                    by_day[d] += n
+        return {"total": total, "by_day": by_day}
+
+    def iter_records(self, since: Optional[int] = None, until: Optional[int] = None) -> Iterator[Tuple[Dict, int]]:
+        # (record, created_at epoch) oldest first, skipping segments outside [since, until). Each
+        # segment is in write order; the segments of one day (one per worker and size rotation) are
+        # merged on created_at, and days follow each other because segments never span a day.
+        days: Dict[str, List[Path]] = {}
+        for path, meta in self._segments():
+            if meta.overlaps(since, until):
+                days.setdefault(self._segment_day(path), []).append(path)
+        for day in sorted(days):
+            yield from heapq.merge(*(self._read(p, since, until) for p in days[day]), key=lambda r: r[1])
+
+    def _segment_day(self, path: Path) -> str:
+        # The legacy single file predates segments and sorts first
+        return "" if path == self.legacy else path.name[len(self.kind) + 1:].split("-", 1)[0]
+
+    @staticmethod
+    def _read(path: Path, since: Optional[int], until: Optional[int]) -> Iterator[Tuple[Dict, int]]:
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    obj = json.loads(line)
+                except ValueError:
+                    continue
+                ts = iso_to_epoch(obj.get("created_at")) or 0
+                if (since is None or ts >= since) and (until is None or ts < until):
+                    yield obj, ts
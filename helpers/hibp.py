@@ -1,22 +1,339 @@
-﻿import os, httpx
-from typing import List, Dict
+﻿import asyncio, json, os, sqlite3, time
+import httpx
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+from helpers import emails, storage, timing
+from helpers.metrics import QUEUE_DEPTH, RATE_LIMITED, cache_lookup
+from helpers.upstream import get_client
 
 API = "https://haveibeenpwned.com/api/v3/breachedaccount/{account}"
+DOMAIN_API = "https://haveibeenpwned.com/api/v3/breacheddomain/{domain}"
+BREACHES_API = "https://haveibeenpwned.com/api/v3/breaches"
 KEY = os.environ.get("HIBP_API_KEY", "").strip()
 
-async def hibp_breaches(email: str) -> List[Dict]:
-    if not KEY:
-        return []
+# Two-tier breachedaccount cache: per-process LRU in front of a table in the shared SQLite db,
+# so every uvicorn worker benefits from a lookup any of them already paid quota for.
+HIBP_CACHE_TTL = int(os.getenv("HIBP_CACHE_TTL", "21600"))          # breached: 6 h
+HIBP_CACHE_NEG_TTL = int(os.getenv("HIBP_CACHE_NEG_TTL", "3600"))   # 404 / not breached: 1 h
+HIBP_CACHE_MAX = int(os.getenv("HIBP_CACHE_MAX", "10000"))          # in-process entries
+HIBP_CACHE_DB = os.getenv("HIBP_CACHE_DB", "1") != "0"
+
+# Client-side rate limiting: the plan's requests-per-minute is split across uvicorn workers
+HIBP_RPM = float(os.getenv("HIBP_RPM", "10"))
+HIBP_BURST = float(os.getenv("HIBP_BURST", "1"))
+HIBP_QUEUE_MAX = int(os.getenv("HIBP_QUEUE_MAX", "50"))  # queued lookups per worker before shedding
+HIBP_BATCH_QUEUE_MAX = int(os.getenv("HIBP_BATCH_QUEUE_MAX", "200"))  # same, for bulk lookups
+# Estimated wait for a token past which a lookup is shed straight away rather than queued
+HIBP_MAX_WAIT_SEC = float(os.getenv("HIBP_MAX_WAIT_SEC", "10"))
+HIBP_BATCH_MAX_WAIT_SEC = float(os.getenv("HIBP_BATCH_MAX_WAIT_SEC", "120"))  # same, for bulk lookups
+HIBP_MAX_RETRIES = int(os.getenv("HIBP_MAX_RETRIES", "2"))  # extra attempts after a 429
+_WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+# Domain search: one breacheddomain call fills a local (domain, alias) -> breach table that then
+# answers per-address lookups for that domain until it goes stale.
+HIBP_DOMAIN_TTL = int(os.getenv("HIBP_DOMAIN_TTL", "86400"))
+_DOMAINS: Dict[str, int] = {}  # domain -> synced_at, refreshed from the db every _DOMAINS_REFRESH seconds
+_DOMAINS_REFRESH = 60
+_DOMAINS_LOADED = 0.0
+
+_MEM: "OrderedDict[str, Tuple[float, List[Dict]]]" = OrderedDict()  # key -> (expires_epoch, breaches)
+_DB_WRITES = 0
+
+class HIBPBusy(Exception):
+    # Raised instead of queueing when the scheduler backlog is full; retry_after is the estimated wait
+    def __init__(self, retry_after: float):
+        super().__init__(f"HIBP queue full, retry in ~{retry_after:.0f}s")
+        self.retry_after = retry_after
+
+class HIBPNotConfigured(RuntimeError):
+    # No HIBP_API_KEY: lookups cannot run, and an empty answer would read as "no breaches"
+    def __init__(self):
+        super().__init__("HIBP_API_KEY is not set")
+
+class _TokenBucket:
+    # FIFO token bucket: asyncio.Lock wakes waiters in arrival order, and the holder sleeps until
+    # a token is available (or a Retry-After penalty has passed), so nothing blocks the event loop.
+    def __init__(self, rate_per_sec: float, burst: float):
+        self.rate = rate_per_sec
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._waiting = 0  # interactive waiters only
+        self._lock = asyncio.Lock()
+        self._batch_waiting = 0
+        self._batch_lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def estimated_wait(self) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        deficit = max(0.0, self._waiting + 1 - self._tokens)
+        return max(0.0, self._blocked_until - now) + deficit / self.rate
+
+    async def acquire(self, batch: bool = False) -> None:
+        if batch:
+            return await self._acquire_batch()
+        wait = self.estimated_wait()
+        if self._waiting >= HIBP_QUEUE_MAX or wait > HIBP_MAX_WAIT_SEC:
+            RATE_LIMITED.labels("hibp_queue").inc()
+            raise HIBPBusy(wait)
+        self._waiting += 1
+        QUEUE_DEPTH.labels("hibp").inc()
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = max(self._blocked_until - now, (1 - self._tokens) / self.rate)
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+                self._tokens -= 1
+        finally:
+            self._waiting -= 1
+            QUEUE_DEPTH.labels("hibp").dec()
+
+    async def _acquire_batch(self) -> None:
+        # Bulk lookups yield to interactive ones: a single batch waiter at a time polls for a token and
+        # takes it only while no interactive lookup is queued (those count in _waiting before they
+        # wait), so a large batch never sits in front of a user's scan.
+        wait = self.estimated_wait() + self._batch_waiting / self.rate
+        if self._batch_waiting >= HIBP_BATCH_QUEUE_MAX or wait > HIBP_BATCH_MAX_WAIT_SEC:
+            RATE_LIMITED.labels("hibp_batch_queue").inc()
+            raise HIBPBusy(wait)
+        self._batch_waiting += 1
+        QUEUE_DEPTH.labels("hibp_batch").inc()
+        try:
+            async with self._batch_lock:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = max(self._blocked_until - now, (1 - self._tokens) / self.rate)
+                    if self._waiting:
+                        wait = max(wait, 1 / self.rate)
+                    elif wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+                self._tokens -= 1
+        finally:
+            self._batch_waiting -= 1
+            QUEUE_DEPTH.labels("hibp_batch").dec()
+
+    def penalize(self, retry_after: float) -> None:
+        self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+        self._tokens = 0.0
+
+_BUCKET = _TokenBucket(HIBP_RPM / 60.0 / _WORKERS, HIBP_BURST)
+_INFLIGHT: Dict[str, "asyncio.Task[List[Dict]]"] = {}
+
+def _db_get(key: str) -> Optional[Tuple[float, List[Dict]]]:
+    with storage.reader() as con:
+        row = con.execute("SELECT expires_at, body FROM hibp_cache WHERE key = ?", (key,)).fetchone()
+    if row and row[0] > time.time():
+        return float(row[0]), json.loads(row[1])
+    return None
+
+def _db_put(key: str, expires: float, data: List[Dict]) -> None:
+    global _DB_WRITES
+    with storage.writer() as con:
+        con.execute(
+            "INSERT OR REPLACE INTO hibp_cache (key, body, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(data, separators=(",", ":")), int(expires)),
+        )
+        _DB_WRITES += 1
+        if _DB_WRITES % 256 == 0:
+            con.execute("DELETE FROM hibp_cache WHERE expires_at < ?", (int(time.time()),))
+        con.commit()
+
+def _mem_put(key: str, expires: float, data: List[Dict]) -> None:
+    _MEM[key] = (expires, data)
+    _MEM.move_to_end(key)
+    while len(_MEM) > HIBP_CACHE_MAX:
+        _MEM.popitem(last=False)
+
+async def _cache_get(key: str) -> Optional[List[Dict]]:
+    hit = _MEM.get(key)
+    if hit:
+        if hit[0] > time.time():
+            _MEM.move_to_end(key)
+            cache_lookup("hibp_mem", True)
+            return hit[1]
+        del _MEM[key]
+    cache_lookup("hibp_mem", False)
+    if not HIBP_CACHE_DB:
+        return None
+    try:
+        row = await asyncio.to_thread(_db_get, key)
+    except sqlite3.Error as e:
+        print(f"[WARN] hibp cache read failed: {e}")
+        return None
+    cache_lookup("hibp_db", row is not None)
+    if row is None:
+        return None
+    _mem_put(key, *row)
+    return row[1]
+
+async def _cache_put(key: str, data: List[Dict]) -> None:
+    expires = time.time() + (HIBP_CACHE_TTL if data else HIBP_CACHE_NEG_TTL)
+    _mem_put(key, expires, data)
+    if HIBP_CACHE_DB:
+        try:
+            await asyncio.to_thread(_db_put, key, expires, data)
+        except sqlite3.Error as e:
+            print(f"[WARN] hibp cache write failed: {e}")
+
+async def _get(url: str, headers: Dict[str, str], params: Optional[Dict] = None, batch: bool = False) -> httpx.Response:
+    # Every HIBP call takes a bucket token; a 429 pauses the bucket for its Retry-After and is retried
+    for attempt in range(HIBP_MAX_RETRIES + 1):
+        with timing.span("ratelimit-hibp"):
+            await _BUCKET.acquire(batch)
+        r = await get_client("hibp").get(url, headers=headers, params=params)
+        if r.status_code != 429 or attempt == HIBP_MAX_RETRIES:
+            break
+        try:
+            retry_after = float(r.headers.get("Retry-After", "2"))
+        except ValueError:
+            retry_after = 2.0
+        _BUCKET.penalize(retry_after)
+    return r
+
+async def _fetch(email: str, batch: bool = False) -> List[Dict]:
     headers = {
         "hibp-api-key": KEY,
         "user-agent": "exposureshield/1.0",
     }
-    params = {"truncateResponse": "false"}
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        r = await client.get(API.format(account=email), headers=headers, params=params)
-        if r.status_code == 404:
-            return []  # no breaches
+    r = await _get(API.format(account=email), headers, {"truncateResponse": "false"}, batch)
+    if r.status_code == 404:
+        return []  # no breaches
+    r.raise_for_status()
+    data = r.json()
+    # Ensure list-of-dicts
+    return data if isinstance(data, list) else []
+
+def _synced_domains() -> Dict[str, int]:
+    global _DOMAINS, _DOMAINS_LOADED
+    now = time.time()
+    if now - _DOMAINS_LOADED > _DOMAINS_REFRESH:
+        with storage.reader() as con:
+            rows = con.execute("SELECT domain, synced_at FROM hibp_domains WHERE synced_at > ?", (int(now) - HIBP_DOMAIN_TTL,)).fetchall()
+        _DOMAINS, _DOMAINS_LOADED = dict(rows), now
+    return _DOMAINS
+
+def _public_breach(b: Dict) -> bool:
+    # What breachedaccount itself would return: the domain search also lists sensitive breaches
+    # (shown only to the verified domain owner) and retired ones, neither of which per-address
+    # lookups may reveal
+    return not b.get("IsSensitive") and not b.get("IsRetired")
+
+def _domain_lookup(email: emails.NormalizedEmail) -> Optional[List[Dict]]:
+    # None means "domain not synced (or stale)": fall through to a per-address lookup.
+    # Serves public per-address lookups, so only breaches breachedaccount would also return.
+    alias, domain = email.local, email.domain
+    synced = _synced_domains().get(domain)
+    if not synced or synced <= time.time() - HIBP_DOMAIN_TTL:
+        return None
+    with storage.reader() as con:
+        rows = con.execute("""
+            SELECT c.body FROM hibp_domain_breaches d
+            JOIN hibp_breach_catalog c ON c.name = d.breach
+            WHERE d.domain = ? AND d.alias = ?
+        """, (domain, alias)).fetchall()
+    return [b for b in (json.loads(body) for (body,) in rows) if _public_breach(b)]
+
+def _store_domain(domain: str, mapping: Dict[str, List[str]], catalog: Optional[List[Dict]]) -> None:
+    now = int(time.time())
+    with storage.writer() as con:
+        with con:
+            if catalog is not None:
+                con.executemany(
+                    "INSERT OR REPLACE INTO hibp_breach_catalog (name, body) VALUES (?, ?)",
+                    [(b["Name"], json.dumps(b, separators=(",", ":"))) for b in catalog if b.get("Name")],
+                )
+            con.execute("DELETE FROM hibp_domain_breaches WHERE domain = ?", (domain,))
+            con.executemany(
+                "INSERT OR IGNORE INTO hibp_domain_breaches (domain, alias, breach) VALUES (?, ?, ?)",
+                [(domain, alias.lower(), name) for alias, names in mapping.items() for name in names],
+            )
+            con.execute(
+                "INSERT OR REPLACE INTO hibp_domains (domain, synced_at, aliases) VALUES (?, ?, ?)",
+                (domain, now, len(mapping)),
+            )
+    _DOMAINS[domain] = now
+
+def _domain_rows(domain: str) -> Tuple[Optional[int], Dict[str, List[str]]]:
+    with storage.reader() as con:
+        row = con.execute("SELECT synced_at FROM hibp_domains WHERE domain = ?", (domain,)).fetchone()
+        pairs = con.execute("SELECT alias, breach FROM hibp_domain_breaches WHERE domain = ? ORDER BY alias", (domain,)).fetchall()
+    mapping: Dict[str, List[str]] = {}
+    for alias, name in pairs:
+        mapping.setdefault(alias, []).append(name)
+    return (row[0] if row else None), mapping
+
+def _catalog_missing(names: set) -> bool:
+    with storage.reader() as con:
+        known = {n for (n,) in con.execute("SELECT name FROM hibp_breach_catalog")}
+    return not names <= known
+
+async def sync_domain(domain: str, force: bool = False) -> Tuple[int, Dict[str, List[str]]]:
+    # Returns (synced_at, {alias: [breach names]}); only calls HIBP when the local copy is missing or stale
+    domain = domain.strip().lower()
+    synced_at, mapping = await asyncio.to_thread(_domain_rows, domain)
+    if synced_at and not force and synced_at > time.time() - HIBP_DOMAIN_TTL:
+        return synced_at, mapping
+    if not KEY:
+        raise HIBPNotConfigured()
+    headers = {"hibp-api-key": KEY, "user-agent": "exposureshield/1.0"}
+    r = await _get(DOMAIN_API.format(domain=domain), headers)
+    if r.status_code == 404:
+        mapping = {}
+    else:
         r.raise_for_status()
-        data = r.json()
-        # Ensure list-of-dicts
-        return data if isinstance(data, list) else []
+        mapping = r.json() or {}
+    # The domain map only carries breach names; keep the full breach catalog alongside it
+    names = {n for v in mapping.values() for n in v}
+    catalog = None
+    if names and (force or await asyncio.to_thread(_catalog_missing, names)):
+        rc = await _get(BREACHES_API, {"user-agent": "exposureshield/1.0"})
+        rc.raise_for_status()
+        catalog = rc.json()
+    await asyncio.to_thread(_store_domain, domain, mapping, catalog)
+    return int(time.time()), {a.lower(): v for a, v in sorted(mapping.items())}
+
+async def hibp_breaches(email: str, batch: bool = False) -> List[Dict]:
+    # batch=True schedules any upstream call behind interactive lookups (see _TokenBucket)
+    if not KEY:
+        raise HIBPNotConfigured()
+    email = emails.normalize(email)
+    key = email.cache_key
+    with timing.span("cache-hibp") as s:
+        cached = await _cache_get(key)
+        s.desc = "miss" if cached is None else "hit"
+    if cached is not None:
+        return cached
+    if HIBP_CACHE_DB:
+        with timing.span("cache-hibp-domain") as s:
+            try:
+                local = await asyncio.to_thread(_domain_lookup, email)
+            except sqlite3.Error as e:
+                print(f"[WARN] hibp domain index read failed: {e}")
+                local = None
+            s.desc = "miss" if local is None else "hit"
+        cache_lookup("hibp_domain", local is not None)
+        if local is not None:
+            _mem_put(key, time.time() + HIBP_CACHE_NEG_TTL, local)
+            return local
+    # Coalesce: concurrent lookups of the same address share one scheduled upstream call
+    task = _INFLIGHT.get(key)
+    if task is None:
+        task = _INFLIGHT[key] = asyncio.ensure_future(_fetch_and_cache(key, email, batch))
+        task.add_done_callback(lambda _t: _INFLIGHT.pop(key, None))
+    return await asyncio.shield(task)
+
+async def _fetch_and_cache(key: str, email: str, batch: bool = False) -> List[Dict]:
+    data = await _fetch(email, batch)
+    await _cache_put(key, data)
+    return data
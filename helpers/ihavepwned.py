@@ -1,18 +1,235 @@
-﻿import json
+﻿import argparse, asyncio, json, os, sqlite3, sys, threading
 from pathlib import Path
-from typing import List, Dict
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
+from helpers import emails
+from helpers.bloom import BloomFilter
 
-_DATA: Dict = {}
-def load_dataset(path: str = "data/ihavepwned.json") -> None:
-    global _DATA
-    p = Path(path)
-    if p.exists():
-        _DATA = json.loads(p.read_text(encoding="utf-8"))
+# Dataset source: .json ({"breaches": [...]}), .ndjson (one row per line) or a compiled .db
+# (python -m helpers.ihavepwned convert data/ihavepwned.json data/ihavepwned.db)
+IHAVEPWNED_PATH = os.getenv("IHAVEPWNED_PATH", "data/ihavepwned.json")
+# Optional Bloom filter in front of the index for cheap negatives (most scanned emails are not in the dataset)
+IHAVEPWNED_BLOOM = os.getenv("IHAVEPWNED_BLOOM", "0") == "1"
+# Seconds between mtime checks of the dataset file (0 disables hot reload)
+IHAVEPWNED_RELOAD_SEC = float(os.getenv("IHAVEPWNED_RELOAD_SEC", "30"))
+_CHUNK = 1 << 16
+
+_Record = Tuple[Tuple[str, object], ...]  # (field, value) pairs of one breach row, minus the email
+
+normalize_email = emails.normalize_text  # plain str; the dataset build has no use for the cached object
+
+def _iter_json_array(f, key: str = "breaches") -> Iterator[Dict]:
+    # Incremental parse of {"<key>": [ {...}, {...} ]} without holding the whole file
+    dec = json.JSONDecoder()
+    buf, eof = "", False
+
+    def fill() -> bool:
+        nonlocal buf, eof
+        chunk = f.read(_CHUNK)
+        eof = not chunk
+        buf += chunk
+        return not eof
+
+    marker = f'"{key}"'
+    while marker not in buf:
+        if not fill():
+            return
+        buf = buf[-(len(marker) + _CHUNK):]
+    buf = buf[buf.index(marker) + len(marker):]
+    while "[" not in buf:
+        if not fill():
+            return
+    pos = buf.index("[") + 1
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(buf):
+            buf, pos = "", 0
+            if not fill():
+                return
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            obj, end = dec.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            buf, pos = buf[pos:], 0
+            fill()
+            continue
+        if isinstance(obj, dict):
+            yield obj
+        pos = end
+
+def iter_breaches(path: str) -> Iterator[Dict]:
+    with open(path, "r", encoding="utf-8-sig") as f:
+        if path.endswith(".ndjson"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from _iter_json_array(f)
+
+class _Dataset:
+    # Built once, then read-only: normalized email -> tuple of compact records
+    __slots__ = ("index", "bloom", "rows")
+
+    def __init__(self, breaches: Iterable[Dict]):
+        index: Dict[str, Tuple[_Record, ...]] = {}
+        rows = 0
+        for b in breaches:
+            e = normalize_email(str(b.get("email", "")))
+            if not e:
+                continue
+            rec = tuple((sys.intern(k), tuple(v) if isinstance(v, list) else v) for k, v in b.items() if k != "email")
+            index[e] = index.get(e, ()) + (rec,)
+            rows += 1
+        self.index = index
+        self.rows = rows
+        self.bloom: Optional[BloomFilter] = None
+        if IHAVEPWNED_BLOOM:
+            self.bloom = BloomFilter(len(index))
+            for e in index:
+                self.bloom.add(e.encode())
+
+    def lookup(self, e: str) -> List[Dict]:
+        if self.bloom is not None and e.encode() not in self.bloom:
+            return []
+        return [{"email": e, **{k: list(v) if isinstance(v, tuple) else v for k, v in rec}} for rec in self.index.get(e, ())]
+
+class _SqliteDataset:
+    # Compiled dataset: rows stay on disk (indexed by email), so RSS does not grow with the dataset
+    __slots__ = ("path", "bloom", "rows", "_local")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        con = self._con()
+        self.rows = con.execute("SELECT COUNT(*) FROM breaches").fetchone()[0]
+        self.bloom: Optional[BloomFilter] = None
+        if IHAVEPWNED_BLOOM:
+            self.bloom = BloomFilter(con.execute("SELECT COUNT(DISTINCT email) FROM breaches").fetchone()[0])
+            for (e,) in con.execute("SELECT DISTINCT email FROM breaches"):
+                self.bloom.add(e.encode())
+
+    def _con(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = self._local.con = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        return con
+
+    def lookup(self, e: str) -> List[Dict]:
+        if self.bloom is not None and e.encode() not in self.bloom:
+            return []
+        rows = self._con().execute("SELECT record FROM breaches WHERE email = ?", (e,)).fetchall()
+        return [{"email": e, **json.loads(r)} for (r,) in rows]
+
+def convert(src: str, dst: str) -> int:
+    out = Path(dst)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_suffix(out.suffix + ".tmp")
+    tmp.unlink(missing_ok=True)
+    n = 0
+    if dst.endswith(".ndjson"):
+        with tmp.open("w", encoding="utf-8") as f:
+            for b in iter_breaches(src):
+                f.write(json.dumps(b, ensure_ascii=False, separators=(",", ":")) + "\n")
+                n += 1
     else:
-        _DATA = {"breaches": []}
+        con = sqlite3.connect(tmp)
+        con.execute("PRAGMA journal_mode=OFF")
+        con.execute("PRAGMA synchronous=OFF")
+        con.execute("CREATE TABLE breaches (email TEXT NOT NULL, record TEXT NOT NULL)")
+        batch = []
+        for b in iter_breaches(src):
+            e = normalize_email(str(b.get("email", "")))
+            if not e:
+                continue
+            batch.append((e, json.dumps({k: v for k, v in b.items() if k != "email"}, ensure_ascii=False, separators=(",", ":"))))
+            if len(batch) >= 10_000:
+                con.executemany("INSERT INTO breaches VALUES (?, ?)", batch)
+                n += len(batch)
+                batch.clear()
+        con.executemany("INSERT INTO breaches VALUES (?, ?)", batch)
+        n += len(batch)
+        # Index after the bulk insert: one sorted build instead of n incremental B-tree updates
+        con.execute("CREATE INDEX idx_breaches_email ON breaches(email)")
+        con.commit()
+        con.execute("VACUUM")
+        con.close()
+    os.replace(tmp, out)
+    return n
+
+def _signature(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def _build(path: str):
+    p = Path(path)
+    if not p.exists():
+        return _Dataset([])
+    if p.suffix in (".db", ".sqlite"):
+        return _SqliteDataset(str(p))
+    return _Dataset(iter_breaches(str(p)))
+
+_DATA = None  # _Dataset | _SqliteDataset; replaced wholesale, never mutated
+_SIG: Optional[Tuple[int, int]] = None
+def load_dataset(path: str = IHAVEPWNED_PATH) -> None:
+    global _DATA, _SIG
+    sig = _signature(path)  # taken first so a write during the build is picked up next poll
+    _DATA = _build(path)
+    _SIG = sig
+
+async def watch_dataset(path: str = IHAVEPWNED_PATH, interval: float = IHAVEPWNED_RELOAD_SEC) -> None:
+    # Poll the file's mtime/size; rebuild in a worker thread and swap the reference in one assignment,
+    # so lookups see either the old or the new index, never a partial one.
+    global _DATA, _SIG
+    if interval <= 0:
+        return
+    bad = None
+    while True:
+        await asyncio.sleep(interval)
+        sig = _signature(path)
+        if sig == _SIG or sig == bad:
+            continue
+        try:
+            ds = await asyncio.to_thread(_build, path)
+        except Exception as e:
+            # Likely caught mid-write; keep serving the old index until the file changes again
+            print(f"[WARN] dataset reload failed: {e!r}")
+            bad = sig
+            continue
+        _DATA, _SIG = ds, sig
+        print(f"[INFO] dataset reloaded from {path}: {ds.rows:,} rows")
 
 def lookup_email(email: str) -> List[Dict]:
-    if not _DATA:
+    if _DATA is None:
         load_dataset()
-    e = email.strip().lower()
-    return [b for b in _DATA.get("breaches", []) if str(b.get("email","")).lower() == e]
+    return _DATA.lookup(emails.normalize(email))
+
+async def lookup_email_async(email: str) -> List[Dict]:
+    # The in-memory index answers inline; the compiled form runs a SQLite query, so that goes to a
+    # thread unless the Bloom filter already rules the address out
+    if _DATA is None:
+        await asyncio.to_thread(load_dataset)
+    ds, e = _DATA, emails.normalize(email)
+    if isinstance(ds, _SqliteDataset) and (ds.bloom is None or e.encode() in ds.bloom):
+        return await asyncio.to_thread(ds.lookup, e)
+    return ds.lookup(e)
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m helpers.ihavepwned")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("convert", help="compile a .json/.ndjson dataset into .db (indexed) or .ndjson")
+    c.add_argument("src")
+    c.add_argument("dst")
+    args = ap.parse_args(argv)
+    n = convert(args.src, args.dst)
+    print(f"wrote {n:,} rows to {args.dst}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
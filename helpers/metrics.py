@@ -0,0 +1,63 @@
+import os
+from typing import Tuple
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import REGISTRY, multiprocess
+
+# Prometheus metrics for /metrics. With several uvicorn workers set PROMETHEUS_MULTIPROC_DIR to an
+# empty, writable directory (before the workers start): every worker then writes its samples to
+# mmapped files there and the scrape aggregates all of them, whichever worker serves it.
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR") or os.getenv("prometheus_multiproc_dir")
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_LATENCY = Histogram(
+    "exposureshield_request_duration_seconds", "HTTP request latency by route template",
+    ["method", "route", "status"], buckets=_LATENCY_BUCKETS,
+)
+UPSTREAM_LATENCY = Histogram(
+    "exposureshield_upstream_duration_seconds", "Upstream call latency (to response headers)",
+    ["upstream", "status"], buckets=_LATENCY_BUCKETS,
+)
+CACHE_LOOKUPS = Counter(
+    "exposureshield_cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"],
+)
+RATE_LIMITED = Counter(
+    "exposureshield_rate_limited_total", "Requests rejected or shed by a limiter", ["limiter"],
+)
+QUEUE_DEPTH = Gauge(
+    "exposureshield_queue_depth", "Items waiting in an in-process queue", ["queue"],
+    multiprocess_mode="livesum",
+)
+BREAKER_OPEN = Gauge(
+    "exposureshield_circuit_open", "1 while a circuit breaker is open", ["upstream"],
+    multiprocess_mode="livemax",
+)
+PERSISTED_ROWS = Counter(
+    "exposureshield_persisted_rows_total", "Write-behind rows by table and outcome (written, fallback, dropped)", ["table", "result"],
+)
+
+CAPTCHA_CHECKS = Counter(
+    "exposureshield_captcha_checks_total", "Captcha verifications by result", ["result"],
+)
+CAPTCHA_REPLAY_FILL = Gauge(
+    "exposureshield_captcha_replay_fill", "Spent nonces in the current replay filter / its capacity",
+    multiprocess_mode="livemax",
+)
+CAPTCHA_REPLAY_ROTATIONS = Counter(
+    "exposureshield_captcha_replay_rotations_total", "Replay filter rotations (period or full)", ["reason"],
+)
+
+def cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+def render() -> Tuple[bytes, str]:
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+def mark_process_dead() -> None:
+    # Drops this worker's live gauges from the aggregate once it exits
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
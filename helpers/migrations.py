@@ -0,0 +1,208 @@
+import argparse, os, sqlite3, sys
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+# Forward-only schema migrations for exposureshield.db, tracked in PRAGMA user_version. The storage
+# writer runs migrate() when it first opens the database (main.py opens it at startup); each step
+# runs in its own IMMEDIATE transaction and re-checks the version inside it, so workers starting at
+# the same time apply every step exactly once. A step can take minutes on a big table (v2 rebuilds
+# scans), so while migrating the connection waits up to MIGRATION_BUSY_SEC for the lock instead of
+# the pool's short busy timeout: the other workers queue behind the one migrating rather than fail
+# startup with "database is locked". For large upgrades, run `python -m helpers.migrations upgrade`
+# once before starting the workers.
+MIGRATION_BUSY_SEC = float(os.getenv("MIGRATION_BUSY_SEC", "3600"))
+
+def _baseline(con: sqlite3.Connection) -> None:
+    # Tables as they existed before versioning (created ad hoc by main.py / helpers.hibp)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS feedback (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          email TEXT NOT NULL,
+          message TEXT NOT NULL,
+          ip TEXT NOT NULL,
+          created_at TEXT NOT NULL
+        )
+    """)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS scans (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          email_hash TEXT NOT NULL,
+          status TEXT NOT NULL,
+          ip TEXT NOT NULL,
+          created_at TEXT NOT NULL
+        )
+    """)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS hibp_cache (
+          key TEXT PRIMARY KEY,
+          body TEXT NOT NULL,
+          expires_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS hibp_domains (
+          domain TEXT PRIMARY KEY,
+          synced_at INTEGER NOT NULL,
+          aliases INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS hibp_domain_breaches (
+          domain TEXT NOT NULL,
+          alias TEXT NOT NULL,
+          breach TEXT NOT NULL,
+          PRIMARY KEY (domain, alias, breach)
+        ) WITHOUT ROWID
+    """)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS hibp_breach_catalog (
+          name TEXT PRIMARY KEY,
+          body TEXT NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+def iso_to_epoch(value) -> Optional[int]:
+    if value is None or isinstance(value, (int, float)):
+        return None if value is None else int(value)
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+def _epoch_timestamps(con: sqlite3.Connection) -> None:
+    # SQLite cannot change a column's type in place: rebuild both tables, keeping ids
+    con.create_function("iso_to_epoch", 1, iso_to_epoch, deterministic=True)
+    con.execute("""
+        CREATE TABLE scans_v2 (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          email_hash TEXT NOT NULL,
+          status TEXT NOT NULL,
+          ip TEXT NOT NULL,
+          created_at INTEGER NOT NULL
+        )
+    """)
+    con.execute("""
+        INSERT INTO scans_v2 (id, email_hash, status, ip, created_at)
+        SELECT id, email_hash, status, ip, COALESCE(iso_to_epoch(created_at), 0) FROM scans
+    """)
+    con.execute("DROP TABLE scans")
+    con.execute("ALTER TABLE scans_v2 RENAME TO scans")
+    con.execute("""
+        CREATE TABLE feedback_v2 (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          email TEXT NOT NULL,
+          message TEXT NOT NULL,
+          ip TEXT NOT NULL,
+          created_at INTEGER NOT NULL
+        )
+    """)
+    con.execute("""
+        INSERT INTO feedback_v2 (id, email, message, ip, created_at)
+        SELECT id, email, message, ip, COALESCE(iso_to_epoch(created_at), 0) FROM feedback
+    """)
+    con.execute("DROP TABLE feedback")
+    con.execute("ALTER TABLE feedback_v2 RENAME TO feedback")
+
+def _indexes(con: sqlite3.Connection) -> None:
+    # Time-range queries (metrics, exports) and per-address history become index range scans
+    con.execute("CREATE INDEX IF NOT EXISTS idx_scans_created_at ON scans(created_at)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_scans_email_hash ON scans(email_hash, created_at)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_feedback_created_at ON feedback(created_at)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_hibp_cache_expires_at ON hibp_cache(expires_at)")
+
+def rebuild_daily_counts(con: sqlite3.Connection) -> None:
+    # Recount daily_counts from the base tables; the v4 step and `python -m helpers.rollups backfill`
+    con.execute("DELETE FROM daily_counts")
+    for kind in ("scans", "feedback"):
+        con.execute(f"""
+            INSERT INTO daily_counts (kind, day, n)
+            SELECT '{kind}', date(created_at, 'unixepoch'), COUNT(*) FROM {kind} GROUP BY 2
+        """)
+
+def _daily_rollups(con: sqlite3.Connection) -> None:
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS daily_counts (
+          kind TEXT NOT NULL,
+          day TEXT NOT NULL,
+          n INTEGER NOT NULL,
+          PRIMARY KEY (kind, day)
+        ) WITHOUT ROWID
+    """)
+    rebuild_daily_counts(con)
+
+def _archive_manifest(con: sqlite3.Connection) -> None:
+    # Columnar archive files of old scans (helpers/archive.py); a file only counts once it is listed here
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS archive_files (
+          name TEXT PRIMARY KEY,
+          kind TEXT NOT NULL,
+          min_id INTEGER NOT NULL,
+          max_id INTEGER NOT NULL,
+          min_ts INTEGER NOT NULL,
+          max_ts INTEGER NOT NULL,
+          rows INTEGER NOT NULL,
+          bytes INTEGER NOT NULL,
+          created_at INTEGER NOT NULL
+        )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS idx_archive_files_kind ON archive_files(kind, max_id)")
+
+# (version, name, step); append only, never edit a step that has shipped
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "baseline", _baseline),
+    (2, "epoch_timestamps", _epoch_timestamps),
+    (3, "indexes", _indexes),
+    (4, "daily_rollups", _daily_rollups),
+    (5, "archive_manifest", _archive_manifest),
+]
+LATEST = MIGRATIONS[-1][0]
+
+def current_version(con: sqlite3.Connection) -> int:
+    return con.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(con: sqlite3.Connection) -> int:
+    if current_version(con) >= LATEST:
+        return LATEST
+    if con.in_transaction:
+        con.commit()
+    busy_ms = con.execute("PRAGMA busy_timeout").fetchone()[0]
+    con.execute(f"PRAGMA busy_timeout = {int(MIGRATION_BUSY_SEC * 1000)}")
+    try:
+        _apply(con)
+    finally:
+        con.execute(f"PRAGMA busy_timeout = {busy_ms}")
+    return current_version(con)
+
+def _apply(con: sqlite3.Connection) -> None:
+    for version, name, step in MIGRATIONS:
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            if current_version(con) >= version:
+                con.rollback()
+                continue
+            step(con)
+            con.execute(f"PRAGMA user_version = {version}")
+            con.commit()
+        except BaseException:
+            con.rollback()
+            raise
+        print(f"[INFO] schema migrated to v{version} ({name})")
+
+def main(argv=None) -> int:
+    from helpers.storage import DB_PATH
+    ap = argparse.ArgumentParser(prog="python -m helpers.migrations")
+    ap.add_argument("cmd", choices=["status", "upgrade"])
+    ap.add_argument("--db", default=str(DB_PATH))
+    args = ap.parse_args(argv)
+    con = sqlite3.connect(args.db, timeout=MIGRATION_BUSY_SEC)
+    if args.cmd == "upgrade":
+        migrate(con)
+    print(f"{args.db}: schema v{current_version(con)} (latest v{LATEST})")
+    con.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
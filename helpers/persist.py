@@ -0,0 +1,157 @@
+import asyncio, os, time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+from helpers import rollups, storage
+from helpers.filestore import SegmentStore
+from helpers.metrics import PERSISTED_ROWS, QUEUE_DEPTH
+
+STORE_MODE = os.getenv("STORE_MODE", "sqlite").lower()  # "sqlite" or "file"
+FEEDBACK_LOG_PATH = Path(os.getenv("FEEDBACK_LOG_PATH", "./feedback.ndjson")).resolve()
+SCANS_LOG_PATH = Path(os.getenv("SCANS_LOG_PATH", "./scans.ndjson")).resolve()
+
+# Write-behind: handlers enqueue rows and return; one background task drains the queue and writes
+# each batch in a single transaction (one fsync), flushing when PERSIST_BATCH_MAX rows are waiting
+# or PERSIST_FLUSH_MS after the first row of a batch arrived. A full queue makes handlers wait
+# (back-pressure) instead of growing memory without bound.
+PERSIST_QUEUE_MAX = int(os.getenv("PERSIST_QUEUE_MAX", "10000"))
+PERSIST_BATCH_MAX = int(os.getenv("PERSIST_BATCH_MAX", "500"))
+PERSIST_FLUSH_MS = float(os.getenv("PERSIST_FLUSH_MS", "50"))
+
+COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "scans": ("email_hash", "status", "ip", "created_at"),
+    "feedback": ("email", "message", "ip", "created_at"),
+}
+LOG_PATHS = {"scans": SCANS_LOG_PATH, "feedback": FEEDBACK_LOG_PATH}  # legacy single-file logs, still read
+FILE_STORES = {kind: SegmentStore(kind, legacy=path) for kind, path in LOG_PATHS.items()}
+# Built once so every batch reuses the same cached prepared statement
+_INSERT = {t: f"INSERT INTO {t} ({', '.join(c)}) VALUES ({', '.join('?' * len(c))})" for t, c in COLUMNS.items()}
+
+_Row = Tuple[str, tuple]  # (table, values in COLUMNS order)
+
+def epoch_iso(ts: int) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+def _group(batch: Sequence[_Row]) -> Dict[str, List[tuple]]:
+    out: Dict[str, List[tuple]] = {}
+    for table, values in batch:
+        out.setdefault(table, []).append(values)
+    return out
+
+def _write_sqlite(groups: Dict[str, List[tuple]]) -> None:
+    with storage.writer() as con:
+        with con:  # one transaction, one commit for the whole batch
+            for table, rows in groups.items():
+                con.executemany(_INSERT[table], rows)
+                rollups.bump(con, table, [r[-1] for r in rows])
+
+def _write_file(groups: Dict[str, List[tuple]]) -> None:
+    for table, rows in groups.items():
+        cols = COLUMNS[table]
+        # NDJSON records keep ISO timestamps, as the single-file logs always had
+        FILE_STORES[table].append([{**dict(zip(cols, r)), "created_at": epoch_iso(r[-1])} for r in rows],
+                                  [r[-1] for r in rows])
+
+def close_files() -> None:
+    for store in FILE_STORES.values():
+        store.close()
+
+def write_batch(batch: Sequence[_Row]) -> str:
+    # Returns the outcome for PERSISTED_ROWS. In sqlite mode a failed batch goes to the NDJSON
+    # segments instead ("fallback"): those rows are kept but do not appear in /admin/metrics or the
+    # exports, which read the database, until they are re-imported.
+    groups = _group(batch)
+    try:
+        if STORE_MODE == "sqlite":
+            _write_sqlite(groups)
+        else:
+            _write_file(groups)
+        return "written"
+    except Exception as e:
+        if STORE_MODE != "sqlite":
+            raise
+        print(f"[WARN] sqlite store failed for {len(batch)} rows: {e}; writing to the NDJSON segments")
+        _write_file(groups)
+        return "fallback"
+
+def _count_rows(batch: Sequence[_Row], result: str) -> None:
+    per_table: Dict[str, int] = {}
+    for table, _ in batch:
+        per_table[table] = per_table.get(table, 0) + 1
+    for table, n in per_table.items():
+        PERSISTED_ROWS.labels(table, result).inc(n)
+
+class WriteBehind:
+    def __init__(self, max_queue: int = PERSIST_QUEUE_MAX, batch_max: int = PERSIST_BATCH_MAX,
+                 flush_sec: float = PERSIST_FLUSH_MS / 1000):
+        self.max_queue = max_queue
+        self.batch_max = max(1, batch_max)
+        self.flush_sec = flush_sec
+        self._queue: Optional[asyncio.Queue] = None  # created on the serving loop by start()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._queue = asyncio.Queue(self.max_queue)
+            self._task = asyncio.create_task(self._run())
+
+    async def put(self, table: str, values: tuple) -> None:
+        if self._task is None or self._task.done():
+            # No writer (lifespan not run, e.g. scripts/tests): write through
+            _count_rows([(table, values)], await asyncio.to_thread(write_batch, [(table, values)]))
+            return
+        await self._queue.put((table, values))
+        QUEUE_DEPTH.labels("persist").set(self._queue.qsize())
+
+    async def _next_batch(self) -> Tuple[List[_Row], bool]:
+        q, loop = self._queue, asyncio.get_running_loop()
+        first = await q.get()
+        if first is None:
+            return [], True
+        batch, deadline = [first], loop.time() + self.flush_sec
+        while len(batch) < self.batch_max:
+            try:
+                item = q.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(q.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _run(self) -> None:
+        done = False
+        while not done:
+            batch, done = await self._next_batch()
+            QUEUE_DEPTH.labels("persist").set(self._queue.qsize())
+            if not batch:
+                continue
+            try:
+                result = await asyncio.to_thread(write_batch, batch)
+            except Exception as e:
+                result = "dropped"
+                print(f"[ERROR] dropped {len(batch)} rows: {e!r}")
+            _count_rows(batch, result)
+
+    async def stop(self) -> None:
+        # Flush everything already queued, then stop the writer
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        await asyncio.to_thread(close_files)  # seal open segments so their index is written
+
+WRITER = WriteBehind()
+
+async def persist_scan(email_hash: str, status: str, ip: str) -> None:
+    await WRITER.put("scans", (email_hash, status, ip, int(time.time())))
+
+async def persist_feedback(email: str, message: str, ip: str) -> None:
+    await WRITER.put("feedback", (email, message, ip, int(time.time())))
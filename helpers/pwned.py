@@ -1,24 +1,109 @@
-﻿import hashlib
-import httpx
+﻿import asyncio, hashlib, os, time
+from array import array
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from helpers import timing
+from helpers.metrics import cache_lookup
+from helpers.upstream import get_client
+from helpers.pwned_local import PwnedIndex
 
 PP_API = "https://api.pwnedpasswords.com/range/{prefix}"
-_CACHE = {}  # prefix -> (expires_epoch, text)
-_TTL = 600  # seconds
+_TTL = int(os.getenv("PWNED_CACHE_TTL", "600"))  # seconds
+_MAX = int(os.getenv("PWNED_CACHE_MAX", "1024"))  # prefixes kept (~18 KB each)
+_KEY_WIDTH = 18  # 35-hex-char suffix, left-padded to 36 hex chars = 18 bytes
+# Optional offline dataset built with `python -m helpers.pwned_local build`; when set it is authoritative
+PWNED_LOCAL_PATH = os.getenv("PWNED_LOCAL_PATH", "").strip()
+_LOCAL: Optional[PwnedIndex] = None
+_LOCAL_ERROR: Optional[Exception] = None  # a failed open is not retried on every request
 
-async def pwned_password_count(password: str) -> int:
-    # SHA1
-    sha = hashlib.sha1(password.encode("utf-8")).hexdigest().upper()
-    prefix, suffix = sha[:5], sha[5:]
-    url = PP_API.format(prefix=prefix)
-    async with httpx.AsyncClient(timeout=10.0, headers={"Add-Padding": "true"}) as client:
-        r = await client.get(url)
-        r.raise_for_status()
-        for line in r.text.splitlines():
+class _Range:
+    # One k-anonymity range: suffixes packed back to back in sorted order + parallel counts
+    __slots__ = ("keys", "counts")
+
+    def __init__(self, text: str):
+        entries = []
+        for line in text.splitlines():
+            sfx, _, count = line.partition(":")
             try:
-                sfx, count = line.split(":")
-                if sfx.strip().upper() == suffix:
-                    return int(count)
+                n = int(count)
+                if n:  # Add-Padding rows carry a zero count
+                    entries.append((bytes.fromhex("0" + sfx.strip()), n))
             except ValueError:
                 continue
-    return 0
+        entries.sort()
+        self.keys = b"".join(k for k, _ in entries)
+        self.counts = array("I", (n for _, n in entries))
+
+    def count(self, suffix: str) -> int:
+        key = bytes.fromhex("0" + suffix)
+        keys, w = self.keys, _KEY_WIDTH
+        lo, hi = 0, len(self.counts)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = keys[mid * w:(mid + 1) * w]
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                return self.counts[mid]
+        return 0
+
+_CACHE: "OrderedDict[str, Tuple[float, _Range]]" = OrderedDict()  # prefix -> (expires_monotonic, range), LRU order
+_INFLIGHT: Dict[str, "asyncio.Task[_Range]"] = {}
 
+async def _fetch_range(prefix: str) -> _Range:
+    r = await get_client("pwned").get(PP_API.format(prefix=prefix), headers={"Add-Padding": "true"})
+    r.raise_for_status()
+    rng = _Range(r.text)
+    _CACHE[prefix] = (time.monotonic() + _TTL, rng)
+    _CACHE.move_to_end(prefix)
+    while len(_CACHE) > _MAX:
+        _CACHE.popitem(last=False)
+    return rng
+
+async def _get_range(prefix: str) -> _Range:
+    hit = _CACHE.get(prefix)
+    if hit and hit[0] > time.monotonic():
+        _CACHE.move_to_end(prefix)
+        cache_lookup("pwned_range", True)
+        timing.record("cache-pwned", 0.0, "hit")
+        return hit[1]
+    cache_lookup("pwned_range", False)
+    timing.record("cache-pwned", 0.0, "miss")
+    # Single-flight: concurrent checks for the same prefix share one upstream fetch
+    task = _INFLIGHT.get(prefix)
+    if task is None:
+        task = _INFLIGHT[prefix] = asyncio.ensure_future(_fetch_range(prefix))
+        task.add_done_callback(lambda _t: _INFLIGHT.pop(prefix, None))
+    return await asyncio.shield(task)
+
+def open_local() -> Optional[PwnedIndex]:
+    # Called once from the app lifespan (in a thread), so a missing or foreign PWNED_LOCAL_PATH stops
+    # startup instead of failing every /scan; outside the app the first lookup opens it
+    global _LOCAL, _LOCAL_ERROR
+    if _LOCAL_ERROR is not None:
+        raise _LOCAL_ERROR
+    if _LOCAL is None and PWNED_LOCAL_PATH:
+        try:
+            _LOCAL = PwnedIndex(PWNED_LOCAL_PATH)
+        except (OSError, ValueError) as e:
+            _LOCAL_ERROR = e
+            raise
+    return _LOCAL
+
+async def pwned_password_count(password: str) -> int:
+    # SHA1
+    h = hashlib.sha1(password.encode("utf-8"))
+    local = _LOCAL
+    if local is None and PWNED_LOCAL_PATH:
+        local = await asyncio.to_thread(open_local)
+    if local is not None:
+        # The binary search touches a few pages of a multi-GB map; a cold page cache turns those
+        # into major faults, so it runs in a thread like the compiled breach-dataset lookups
+        with timing.span("pwned-local"):
+            return await asyncio.to_thread(local.count, h.digest())
+    sha = h.hexdigest().upper()
+    prefix, suffix = sha[:5], sha[5:]
+    rng = await _get_range(prefix)
+    return rng.count(suffix)
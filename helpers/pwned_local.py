@@ -0,0 +1,142 @@
+﻿# Offline Pwned Passwords lookups from a memory-mapped, hash-sorted binary file.
+# Build once from the downloadable SHA-1 dump ("HASH:COUNT" per line):
+#
+#   python -m helpers.pwned_local build pwnedpasswords.txt data/pwnedpasswords.bin
+#
+# File layout (little-endian):
+#   header   8s magic + uint64 record count
+#   index    (2**20 + 1) uint64 record offsets, one per 5-hex-char prefix
+#   records  20-byte SHA-1 digest + uint32 count, sorted by digest
+import argparse, hashlib, mmap, os, struct, sys, tempfile
+from array import array
+from pathlib import Path
+
+MAGIC = b"ESPWND01"
+HEADER = struct.Struct("<8sQ")
+RECORD = struct.Struct("<20sI")
+PREFIX_BITS = 20  # same 5-hex-char prefix as the k-anonymity range API
+INDEX_SLOTS = (1 << PREFIX_BITS) + 1
+_BUCKETS = 256  # partition files used by the builder (first digest byte)
+
+class PwnedIndex:
+    # Read-only mmap: every uvicorn worker shares the same page-cache pages
+    def __init__(self, path: str):
+        self._f = open(path, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.size = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path}: not a pwned-passwords index")
+        self._index = HEADER.size
+        self._records = self._index + INDEX_SLOTS * 8
+
+    def count(self, digest: bytes) -> int:
+        mm, w, base = self._mm, RECORD.size, self._records
+        prefix = int.from_bytes(digest[:3], "big") >> (24 - PREFIX_BITS)
+        lo, hi = struct.unpack_from("<QQ", mm, self._index + prefix * 8)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            off = base + mid * w
+            k = mm[off:off + 20]
+            if k < digest:
+                lo = mid + 1
+            elif k > digest:
+                hi = mid
+            else:
+                return struct.unpack_from("<I", mm, off + 20)[0]
+        return 0
+
+    def close(self) -> None:
+        if not self._mm.closed:
+            self._mm.close()
+        self._f.close()
+
+def _parse(line: bytes):
+    h, _, count = line.strip().partition(b":")
+    if len(h) != 40:
+        raise ValueError(f"expected a 40-char SHA-1 hash, got {h[:48]!r}")
+    return bytes.fromhex(h.decode("ascii")), int(count)
+
+def build(src: str, dst: str) -> int:
+    out = Path(dst)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=out.parent) as tmp:
+        # Pass 1: partition records by first digest byte so each bucket sorts in memory
+        parts = [open(os.path.join(tmp, f"{i:02x}"), "wb") for i in range(_BUCKETS)]
+        try:
+            with open(src, "rb") as f:
+                for line in f:
+                    if line.strip():
+                        digest, n = _parse(line)
+                        parts[digest[0]].write(RECORD.pack(digest, min(n, 0xFFFFFFFF)))
+        finally:
+            for p in parts:
+                p.close()
+
+        # Pass 2: sort + merge duplicates per bucket, append, and count records per prefix
+        offsets = array("Q", bytes(INDEX_SLOTS * 8))
+        total = 0
+        shift = 24 - PREFIX_BITS
+
+        def emit(f, digest: bytes, n: int) -> None:
+            nonlocal total
+            f.write(RECORD.pack(digest, min(n, 0xFFFFFFFF)))
+            offsets[(int.from_bytes(digest[:3], "big") >> shift) + 1] += 1
+            total += 1
+
+        tmp_out = out.with_suffix(out.suffix + ".tmp")
+        with open(tmp_out, "wb") as f:
+            f.write(HEADER.pack(MAGIC, 0))
+            f.write(offsets.tobytes())
+            for i in range(_BUCKETS):
+                path = os.path.join(tmp, f"{i:02x}")
+                with open(path, "rb") as p:
+                    buf = p.read()
+                os.remove(path)
+                recs = sorted(buf[j:j + RECORD.size] for j in range(0, len(buf), RECORD.size))
+                del buf
+                prev, acc = None, 0
+                for rec in recs:
+                    digest, n = RECORD.unpack(rec)
+                    if digest == prev:
+                        acc += n
+                        continue
+                    if prev is not None:
+                        emit(f, prev, acc)
+                    prev, acc = digest, n
+                if prev is not None:
+                    emit(f, prev, acc)
+            for j in range(1, INDEX_SLOTS):
+                offsets[j] += offsets[j - 1]
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, total))
+            f.write(offsets.tobytes())
+        os.replace(tmp_out, out)
+    return total
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m helpers.pwned_local")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="convert a SHA-1:count dump into a binary index")
+    b.add_argument("src")
+    b.add_argument("dst")
+    q = sub.add_parser("query", help="look up a password (or 40-char SHA-1) in an index")
+    q.add_argument("index")
+    q.add_argument("password")
+    args = ap.parse_args(argv)
+    if args.cmd == "build":
+        n = build(args.src, args.dst)
+        print(f"wrote {n:,} hashes to {args.dst}")
+        return 0
+    val = args.password
+    digest = bytes.fromhex(val) if len(val) == 40 and all(c in "0123456789abcdefABCDEF" for c in val) \
+        else hashlib.sha1(val.encode("utf-8")).digest()
+    idx = PwnedIndex(args.index)
+    try:
+        print(idx.count(digest))
+    finally:
+        idx.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
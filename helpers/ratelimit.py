@@ -0,0 +1,336 @@
+﻿import asyncio, hashlib, math, mmap, os, socket, sqlite3, struct, tempfile, threading, time
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+from helpers.metrics import RATE_LIMITED
+
+try:
+    import fcntl
+except ImportError:  # Windows dev boxes: shared-memory backend unavailable
+    fcntl = None
+
+# Backend selection: memory (per process), shm (mmap table shared by same-host workers),
+# sqlite (shared file, same host) or redis (any Redis-protocol server, across replicas)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_SHM_PATH = os.getenv("RATE_LIMIT_SHM_PATH") or os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "exposureshield-ratelimit-sw")
+RATE_LIMIT_SHM_SLOTS = int(os.getenv("RATE_LIMIT_SHM_SLOTS", "65536"))
+# Its own file next to the app database: the limiter's write lock must never queue behind the
+# write-behind writer or the HIBP cache (and its throwaway table stays out of the migrated schema)
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH") or os.path.join(
+    os.path.dirname(os.getenv("DB_PATH", "./exposureshield.db")) or ".", "ratelimit.db")
+RATE_LIMIT_DB_TIMEOUT = float(os.getenv("RATE_LIMIT_DB_TIMEOUT", "0.25"))
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://127.0.0.1:6379/0")
+
+# Every backend runs the same sliding-window-counter step. Time is cut into fixed windows and a key
+# keeps the number of its current window plus two counts: requests admitted in that window and in
+# the one before. The previous count is weighted by how much of it still overlaps the sliding
+# window ending now, and a request is admitted while that estimate, rounded to the nearest request,
+# is under the limit. sliding() applies the step to a batch of keys atomically and returns, per key,
+# 0.0 when allowed or the seconds until the next request would be allowed.
+# Backends with `blocking = True` do I/O that can wait (a file lock, a socket); RateLimiter's async
+# methods run those in a thread so a slow check never stalls the event loop.
+
+def window_step(idx: int, prev: int, curr: int, limit: int, window: float, now: float) -> Tuple[int, int, int, float]:
+    # (window number, previous count, current count) -> the same after one request, plus its wait
+    start = math.floor(now / window)
+    if idx != start:
+        prev, curr, idx = (curr if idx == start - 1 else 0), 0, start
+    elapsed = now - start * window
+    budget = limit - 0.5
+    if prev * (1 - elapsed / window) + curr <= budget + 1e-9:
+        return idx, prev, curr + 1, 0.0
+    if curr <= budget:
+        # the previous window's share decays below the budget later in this window
+        return idx, prev, curr, window * (1 - (budget - curr) / prev) - elapsed
+    # this window alone is over budget: wait for its own share to decay in the next one
+    return idx, prev, curr, window - elapsed + window * (1 - budget / curr)
+
+class MemoryBackend:
+    # Keys live in an LRU; a key untouched for two windows carries no information and is dropped first
+    blocking = False
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._state: "OrderedDict[str, Tuple[int, int, int]]" = OrderedDict()
+
+    def sliding(self, keys: Sequence[str], limit: int, window: float, now: float) -> List[float]:
+        out = []
+        for key in keys:
+            idx, prev, curr, wait = window_step(*self._state.get(key, (0, 0, 0)), limit, window, now)
+            self._state[key] = (idx, prev, curr)
+            self._state.move_to_end(key)
+            out.append(wait)
+        self._evict(math.floor(now / window))
+        return out
+
+    def _evict(self, idx: int) -> None:
+        state = self._state
+        while state:
+            oldest = next(iter(state))
+            if state[oldest][0] >= idx - 1 and len(state) <= self.max_keys:
+                break
+            state.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+class SharedMemoryBackend:
+    # Fixed-size open-addressing table in an mmapped file: slot = (uint64 key hash, int64 window
+    # number, uint32 previous count, uint32 current count). All same-host workers map the same file;
+    # flock serialises each batch. When the probe window is full, the slot with the oldest window
+    # is recycled, so memory never grows.
+    _SLOT = struct.Struct("<QqII")
+    _PROBES = 8
+    blocking = False  # flock is held for a few µs per batch
+
+    def __init__(self, path: str = RATE_LIMIT_SHM_PATH, slots: int = RATE_LIMIT_SHM_SLOTS):
+        if fcntl is None:
+            raise RuntimeError("shm rate-limit backend needs fcntl (POSIX)")
+        self.slots = slots
+        size = slots * self._SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._mm = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") | 1
+
+    def _slot(self, h: int, current: int) -> int:
+        mm, slot, best, best_idx = self._mm, self._SLOT, -1, None
+        for i in range(self._PROBES):
+            pos = (h + i) % self.slots
+            kh, idx, _, _ = slot.unpack_from(mm, pos * slot.size)
+            if kh == h:
+                return pos
+            score = -1 if kh == 0 or idx < current - 1 else idx
+            if best_idx is None or score < best_idx:
+                best, best_idx = pos, score
+        slot.pack_into(mm, best * slot.size, h, 0, 0, 0)
+        return best
+
+    def sliding(self, keys: Sequence[str], limit: int, window: float, now: float) -> List[float]:
+        hashes = [self._hash(k) for k in keys]
+        current = math.floor(now / window)
+        out = []
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                for h in hashes:
+                    off = self._slot(h, current) * self._SLOT.size
+                    _, idx, prev, curr = self._SLOT.unpack_from(self._mm, off)
+                    idx, prev, curr, wait = window_step(idx, prev, curr, limit, window, now)
+                    self._SLOT.pack_into(self._mm, off, h, idx, prev, curr)
+                    out.append(wait)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return out
+
+class SQLiteBackend:
+    # One IMMEDIATE transaction per batch; the table is disposable, so durability is traded for speed
+    blocking = True
+
+    def __init__(self, path: str = RATE_LIMIT_DB_PATH):
+        self.path = path
+        self._con: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._batches = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._con is None:
+            con = sqlite3.connect(self.path, check_same_thread=False, timeout=RATE_LIMIT_DB_TIMEOUT, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=OFF")
+            con.execute("DROP TABLE IF EXISTS ratelimit")  # pre-sliding-window GCRA state
+            con.execute("CREATE TABLE IF NOT EXISTS ratelimit_sw (key TEXT PRIMARY KEY, idx INTEGER NOT NULL,"
+                        " prev INTEGER NOT NULL, curr INTEGER NOT NULL) WITHOUT ROWID")
+            self._con = con
+        return self._con
+
+    def sliding(self, keys: Sequence[str], limit: int, window: float, now: float) -> List[float]:
+        out = []
+        with self._lock:
+            con = self._connect()
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                for key in keys:
+                    row = con.execute("SELECT idx, prev, curr FROM ratelimit_sw WHERE key = ?", (key,)).fetchone()
+                    idx, prev, curr, wait = window_step(*(row or (0, 0, 0)), limit, window, now)
+                    if not wait:
+                        con.execute("INSERT OR REPLACE INTO ratelimit_sw (key, idx, prev, curr) VALUES (?, ?, ?, ?)",
+                                    (key, idx, prev, curr))
+                    out.append(wait)
+                self._batches += 1
+                if self._batches % 1024 == 0:
+                    con.execute("DELETE FROM ratelimit_sw WHERE idx < ?", (math.floor(now / window) - 1,))
+                con.execute("COMMIT")
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+        return out
+
+class RedisBackend:
+    # Minimal RESP client: the window step (window_step, in Lua) runs server-side in one EVALSHA per
+    # batch (atomic, one RTT). Each key is "<window number> <previous> <current>", expiring with
+    # the window after the current one.
+    blocking = True
+    _SCRIPT = """
+local now, limit, window = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local start = math.floor(now / window)
+local elapsed = now - start * window
+local budget = limit - 0.5
+local ttl = math.ceil(((start + 2) * window - now) * 1000)
+local out = {}
+for i, key in ipairs(KEYS) do
+  local idx, prev, curr = start, 0, 0
+  local v = redis.call('GET', key)
+  if v then
+    local a, b, c = string.match(v, '^(%S+) (%S+) (%S+)$')
+    idx, prev, curr = tonumber(a), tonumber(b), tonumber(c)
+    if idx ~= start then
+      if idx == start - 1 then prev = curr else prev = 0 end
+      curr = 0
+    end
+  end
+  if prev * (1 - elapsed / window) + curr <= budget + 1e-9 then
+    redis.call('SET', key, string.format('%d %d %d', start, prev, curr + 1), 'PX', ttl)
+    out[i] = '0'
+  elseif curr <= budget then
+    out[i] = string.format('%.17g', window * (1 - (budget - curr) / prev) - elapsed)
+  else
+    out[i] = string.format('%.17g', window - elapsed + window * (1 - budget / curr))
+  end
+end
+return out
+"""
+
+    def __init__(self, url: str = RATE_LIMIT_REDIS_URL, timeout: float = 0.05):
+        u = urlparse(url)
+        self._addr = (u.hostname or "127.0.0.1", u.port or 6379)
+        self._password = u.password
+        self._db = int((u.path or "/0").lstrip("/") or 0)
+        self._timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._rfile = None
+        self._sha = hashlib.sha1(self._SCRIPT.encode()).hexdigest()
+        self._lock = threading.Lock()
+
+    def _connect(self) -> None:
+        self._sock = socket.create_connection(self._addr, timeout=self._timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._rfile = self._sock.makefile("rb")
+        if self._password:
+            self._call("AUTH", self._password)
+        if self._db:
+            self._call("SELECT", str(self._db))
+
+    def _call(self, *args: str):
+        parts = [b"*%d\r\n" % len(args)]
+        for a in args:
+            b = a.encode() if isinstance(a, str) else a
+            parts.append(b"$%d\r\n%s\r\n" % (len(b), b))
+        self._sock.sendall(b"".join(parts))
+        return self._read()
+
+    def _read(self):
+        line = self._rfile.readline()
+        if not line:
+            raise ConnectionError("redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RuntimeError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            data = self._rfile.read(n + 2)[:-2]
+            return data.decode()
+        if kind == b"*":
+            n = int(rest)
+            return None if n < 0 else [self._read() for _ in range(n)]
+        raise RuntimeError(f"bad RESP reply {line!r}")
+
+    def _command(self, *args: str):
+        # One command on the shared connection, reconnecting lazily after a failure
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self._connect()
+                return self._call(*args)
+            except (OSError, ConnectionError):
+                if self._sock is not None:
+                    self._sock.close()
+                self._sock = None
+                raise
+
+    def sliding(self, keys: Sequence[str], limit: int, window: float, now: float) -> List[float]:
+        args = [str(len(keys)), *keys, repr(now), str(limit), repr(window)]
+        try:
+            res = self._command("EVALSHA", self._sha, *args)
+        except RuntimeError as e:
+            if not str(e).startswith("NOSCRIPT"):
+                raise
+            res = self._command("EVAL", self._SCRIPT, *args)
+        return [float(x) for x in res]
+
+    def set_once(self, key: str, ttl: float) -> bool:
+        # True if the key was absent (and is now set for ttl seconds); the captcha's spent nonces
+        return self._command("SET", key, "1", "NX", "PX", str(max(1, int(ttl * 1000)))) == "OK"
+
+def make_backend(kind: str = RATE_LIMIT_BACKEND, max_keys: int = 100_000):
+    if kind == "shm":
+        return SharedMemoryBackend()
+    if kind == "sqlite":
+        return SQLiteBackend()
+    if kind == "redis":
+        return RedisBackend()
+    return MemoryBackend(max_keys)
+
+class RateLimiter:
+    # About `limit` requests per sliding `window` seconds per key, all of which may arrive as a burst.
+    # The counter assumes the previous window's requests were spread evenly, so a single window can
+    # admit up to 2 * limit - 1 when they were bunched at its end; the sustained rate stays at limit
+    # per window and spent budget comes back as the previous window slides out.
+    # Fails open: a broken shared backend must not take feedback/scan down with it.
+    __slots__ = ("name", "limit", "window", "backend")
+
+    def __init__(self, limit: int, window: float, max_keys: int = 100_000, backend=None, name: str = "rl"):
+        self.name = name
+        self.limit = max(1, limit)
+        self.window = float(window)
+        self.backend = backend if backend is not None else MemoryBackend(max_keys)
+
+    def hit_many(self, keys: Sequence[str], now: float = None) -> List[float]:
+        if now is None:
+            now = time.time()  # wall clock: comparable across workers and hosts
+        try:
+            waits = self.backend.sliding([f"{self.name}:{k}" for k in keys], self.limit, self.window, now)
+        except (OSError, sqlite3.Error, RuntimeError, ConnectionError) as e:
+            print(f"[WARN] rate limiter backend failed, allowing: {e!r}")
+            return [0.0] * len(keys)
+        rejected = sum(1 for w in waits if w > 0)
+        if rejected:
+            RATE_LIMITED.labels(self.name).inc(rejected)
+        return waits
+
+    def hit(self, key: str, now: float = None) -> float:
+        return self.hit_many([key], now)[0]
+
+    async def hit_many_async(self, keys: Sequence[str], now: float = None) -> List[float]:
+        if getattr(self.backend, "blocking", True):
+            return await asyncio.to_thread(self.hit_many, keys, now)
+        return self.hit_many(keys, now)
+
+    async def hit_async(self, key: str, now: float = None) -> float:
+        return (await self.hit_many_async([key], now))[0]
@@ -0,0 +1,101 @@
+import os, queue, sqlite3, threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional
+from helpers import migrations
+
+# One writer connection plus a small pool of reader connections on exposureshield.db. In WAL mode
+# readers never block the writer (or each other), so an admin export running on a reader does not
+# stall scan inserts. Each connection keeps its own prepared-statement cache keyed by SQL text, so
+# callers should use constant SQL strings with ? parameters.
+DB_PATH = Path(os.getenv("DB_PATH", "./exposureshield.db")).resolve()
+SQLITE_READERS = int(os.getenv("SQLITE_READERS", "4"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()  # NORMAL is durable enough under WAL
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 << 20)))
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", "16384"))  # page cache per connection
+SQLITE_BUSY_SEC = float(os.getenv("SQLITE_BUSY_SEC", "5"))
+SQLITE_CACHED_STATEMENTS = int(os.getenv("SQLITE_CACHED_STATEMENTS", "256"))
+
+class Pool:
+    def __init__(self, path: Path = DB_PATH, readers: int = SQLITE_READERS):
+        self.path = Path(path)
+        self.readers = max(1, readers)
+        self._writer: Optional[sqlite3.Connection] = None
+        self._writer_lock = threading.RLock()
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.readers)
+        self._all: List[sqlite3.Connection] = []
+
+    def _open(self, readonly: bool) -> sqlite3.Connection:
+        con = sqlite3.connect(self.path, check_same_thread=False, timeout=SQLITE_BUSY_SEC,
+                              cached_statements=SQLITE_CACHED_STATEMENTS)
+        con.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        con.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        con.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+        con.execute("PRAGMA temp_store=MEMORY")
+        if readonly:
+            con.execute("PRAGMA query_only=ON")
+        self._all.append(con)
+        return con
+
+    def _writer_con(self) -> sqlite3.Connection:
+        if self._writer is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            con = self._open(readonly=False)
+            con.execute("PRAGMA journal_mode=WAL")  # persistent in the file; readers inherit it
+            migrations.migrate(con)
+            self._writer = con
+        return self._writer
+
+    def open(self) -> int:
+        # Opens the writer (running any pending migrations) and returns the schema version
+        with self.writer() as con:
+            return migrations.current_version(con)
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        # Serialised: SQLite allows one writer at a time anyway, this just avoids busy-waiting on it
+        with self._writer_lock:
+            yield self._writer_con()
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        if self._writer is None:
+            with self._writer_lock:
+                self._writer_con()  # migrations must have run before the first read
+        with self._slots:
+            try:
+                con = self._idle.get_nowait()
+            except queue.Empty:
+                con = self._open(readonly=True)
+            try:
+                yield con
+            finally:
+                if con.in_transaction:
+                    con.rollback()
+                self._idle.put(con)
+
+    def close(self) -> None:
+        with self._writer_lock:
+            for con in self._all:
+                con.close()
+            self._all.clear()
+            self._writer = None
+            self._idle = queue.LifoQueue()
+
+_POOL: Optional[Pool] = None
+_POOL_LOCK = threading.Lock()
+
+def pool() -> Pool:
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = Pool()
+    return _POOL
+
+def writer():
+    return pool().writer()
+
+def reader():
+    return pool().reader()
@@ -0,0 +1,85 @@
+import contextvars, json, os, time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+# Request-scoped timing spans. The HTTP middleware opens a collector per request in a contextvar;
+# span()/record() anywhere below it (including tasks spawned by the request and asyncio.to_thread
+# calls, which copy the context) add named spans to it. Outside a request they are no-ops.
+# The spans are returned as a Server-Timing header when the caller opts in, and logged as one JSON
+# line for slow requests.
+#   SERVER_TIMING=off    never send the header
+#   SERVER_TIMING=admin  only to requests carrying a valid X-Admin-Token (default)
+#   SERVER_TIMING=on     also to any request sending "X-Server-Timing: 1"
+# Per-request timings reveal cache hits (e.g. whether an address was scanned recently), so keep
+# "on" to internal deployments.
+SERVER_TIMING = os.getenv("SERVER_TIMING", "admin").lower()
+OPT_IN_HEADER = "X-Server-Timing"
+# Requests at least this slow get a [TIMING] log line (0 logs every request, negative disables)
+TIMING_LOG_MS = float(os.getenv("TIMING_LOG_MS", "1000"))
+_MAX_HEADER_SPANS = 32
+
+class Span:
+    __slots__ = ("name", "desc")
+
+    def __init__(self, name: str, desc: Optional[str] = None):
+        self.name = name
+        self.desc = desc
+
+class Timings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans: List[Tuple[str, float, Optional[str]]] = []  # (name, seconds, desc)
+
+    def header(self, total: float) -> str:
+        parts = []
+        for name, dur, desc in self.spans[:_MAX_HEADER_SPANS]:
+            desc_part = f';desc="{desc}"' if desc else ""
+            parts.append(f"{name}{desc_part};dur={dur * 1000:.1f}")
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+    def log(self, method: str, route: str, status: int, total: float) -> None:
+        print("[TIMING] " + json.dumps({
+            "method": method, "route": route, "status": status, "total_ms": round(total * 1000, 1),
+            "spans": [{"name": n, "ms": round(d * 1000, 1), **({"desc": s} if s else {})} for n, d, s in self.spans],
+        }))
+
+_CURRENT: "contextvars.ContextVar[Optional[Timings]]" = contextvars.ContextVar("timings", default=None)
+
+def begin() -> Tuple[Timings, contextvars.Token]:
+    t = Timings()
+    return t, _CURRENT.set(t)
+
+def end(token: contextvars.Token) -> None:
+    _CURRENT.reset(token)
+
+def record(name: str, seconds: float, desc: Optional[str] = None) -> None:
+    t = _CURRENT.get()
+    if t is not None:
+        t.spans.append((name, seconds, desc))
+
+@contextmanager
+def span(name: str, desc: Optional[str] = None) -> Iterator[Span]:
+    # The yielded Span's desc may be set inside the block (e.g. to "hit"/"miss")
+    s = Span(name, desc)
+    t = _CURRENT.get()
+    if t is None:
+        yield s
+        return
+    t0 = time.perf_counter()
+    try:
+        yield s
+    finally:
+        t.spans.append((s.name, time.perf_counter() - t0, s.desc))
+
+def since_start(name: str, desc: Optional[str] = None) -> None:
+    # Span from the start of the request to now; used at the top of handlers whose body FastAPI has
+    # already read and validated, where the two cannot be timed separately
+    t = _CURRENT.get()
+    if t is not None:
+        t.spans.append((name, time.perf_counter() - t.start, desc))
+
+def wants_header(opted_in: bool, is_admin: bool) -> bool:
+    if SERVER_TIMING == "off":
+        return False
+    return is_admin or (SERVER_TIMING == "on" and opted_in)
@@ -1,21 +1,156 @@
-﻿from typing import Optional
-import os, httpx
+import asyncio, hashlib, os, time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+from helpers.metrics import BREAKER_OPEN, cache_lookup
+from helpers.upstream import get_client
 
 TURNSTILE_VERIFY_URL = "https://challenges.cloudflare.com/turnstile/v0/siteverify"
 
-async def verify_turnstile(token: str, remote_ip: Optional[str] = None) -> bool:
-    secret = os.getenv("TURNSTILE_SECRET_KEY")
-    if not secret:
+# Verdicts are cached per token for a little longer than Cloudflare keeps a token valid (300 s), so a
+# frontend retry of the same submission gets the first answer instead of "timeout-or-duplicate".
+# A success is single-use like the token itself: whoever takes it first gets True, everyone after
+# gets False. Failures stay cached for the whole TTL.
+TURNSTILE_CACHE_TTL = int(os.getenv("TURNSTILE_CACHE_TTL", "310"))
+TURNSTILE_CACHE_MAX = int(os.getenv("TURNSTILE_CACHE_MAX", "10000"))
+# Latency budget per verification; past it the caller falls back to the math challenge
+TURNSTILE_BUDGET_SEC = float(os.getenv("TURNSTILE_BUDGET_SEC", "1.5"))
+# Consecutive over-budget/failed calls that open the breaker, and how long it then stays open
+TURNSTILE_BREAKER_THRESHOLD = int(os.getenv("TURNSTILE_BREAKER_THRESHOLD", "5"))
+TURNSTILE_BREAKER_COOLDOWN = float(os.getenv("TURNSTILE_BREAKER_COOLDOWN", "30"))
+
+_VERDICTS: "OrderedDict[str, Tuple[float, bool]]" = OrderedDict()  # key -> (expires_monotonic, success)
+_INFLIGHT: Dict[str, "asyncio.Task[Optional[bool]]"] = {}
+_OVER_BUDGET: Set[str] = set()  # in-flight keys whose owner already counted a breaker failure
+
+class _Breaker:
+    # closed -> open after `threshold` consecutive failures; after `cooldown` one probe is let through
+    # (half-open) and its outcome closes or re-opens the breaker. The probe stays in flight until its
+    # upstream call finishes (end_probe), even if the request that started it has given up waiting.
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.failures < self.threshold:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return True
         return False
+
+    def success(self) -> None:
+        self.failures = 0
+        BREAKER_OPEN.labels("turnstile").set(0)
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            BREAKER_OPEN.labels("turnstile").set(1)
+
+    def end_probe(self) -> None:
+        self._probing = False
+
+_BREAKER = _Breaker(TURNSTILE_BREAKER_THRESHOLD, TURNSTILE_BREAKER_COOLDOWN)
+
+def _key(token: str, remote_ip: Optional[str]) -> str:
+    # Tokens run to a couple of KB; keep a digest instead
+    return hashlib.sha256(f"{token}|{remote_ip or ''}".encode()).hexdigest()
+
+def _cache_put(key: str, success: bool) -> None:
+    _VERDICTS[key] = (time.monotonic() + TURNSTILE_CACHE_TTL, success)
+    _VERDICTS.move_to_end(key)
+    while len(_VERDICTS) > TURNSTILE_CACHE_MAX:
+        _VERDICTS.popitem(last=False)
+
+async def _siteverify(key: str, secret: str, token: str, remote_ip: Optional[str]) -> Optional[bool]:
+    # None means "Cloudflare did not give a verdict" (network error / 5xx); that is never cached
     data = {"secret": secret, "response": token}
     if remote_ip:
         data["remoteip"] = remote_ip
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            r = await client.post(TURNSTILE_VERIFY_URL, data=data)
-            if r.status_code != 200:
-                return False
-            js = r.json()
-            return bool(js.get("success"))
+        r = await get_client("turnstile").post(TURNSTILE_VERIFY_URL, data=data)
+        if r.status_code >= 500:
+            return None
+        success = r.status_code == 200 and bool(r.json().get("success"))
     except Exception:
-        return False
+        return None
+    _cache_put(key, success)
+    return success
+
+def _take(key: str) -> Optional[bool]:
+    # Cached verdict or None; a success turns into a failure as it is handed out, which is what
+    # Cloudflare would answer for the spent token
+    hit = _VERDICTS.get(key)
+    if hit is None:
+        return None
+    if hit[0] <= time.monotonic():
+        del _VERDICTS[key]
+        return None
+    if hit[1]:
+        _VERDICTS[key] = (hit[0], False)
+    return hit[1]
+
+async def turnstile_verdict(token: str, remote_ip: Optional[str] = None) -> Optional[bool]:
+    # True/False is Cloudflare's answer; None means Turnstile is unavailable right now (not configured,
+    # breaker open, upstream error or over budget) and the caller should use the math challenge.
+    secret = os.getenv("TURNSTILE_SECRET_KEY")
+    if not secret:
+        return None
+    key = _key(token, remote_ip)
+    cached = _take(key)
+    cache_lookup("turnstile", cached is not None)
+    if cached is not None:
+        return cached
+    # Coalesce duplicate submissions of the same token onto one upstream call
+    task = _INFLIGHT.get(key)
+    if task is None:
+        probe = _BREAKER.state != "closed"
+        if not _BREAKER.allow():
+            return None
+        task = _INFLIGHT[key] = asyncio.ensure_future(_siteverify(key, secret, token, remote_ip))
+        task.add_done_callback(lambda t: _settle(key, t, probe))
+        owner = True
+    else:
+        owner = False
+    try:
+        # The shielded call keeps running past the budget and still caches its verdict for a retry
+        verdict = await asyncio.wait_for(asyncio.shield(task), TURNSTILE_BUDGET_SEC)
+    except asyncio.TimeoutError:
+        if owner and not task.done():
+            # Over budget counts against Cloudflare even if it answers later
+            _OVER_BUDGET.add(key)
+            _BREAKER.failure()
+        return None
+    # Only one of the coalesced callers gets to spend a success
+    return bool(_take(key)) if verdict else verdict
+
+def _settle(key: str, task: "asyncio.Task[Optional[bool]]", probe: bool) -> None:
+    # Runs when the upstream call finishes, whether or not the request that started it is still
+    # waiting (it may have timed out or been cancelled), so a half-open probe always resolves.
+    # A late answer was already counted as a failure by its owner and must not close the breaker,
+    # unless it is the probe. Only here does a probe end: its owner's over-budget failure re-opens the
+    # breaker but leaves the probe in flight, so no second one starts while this call is pending.
+    _INFLIGHT.pop(key, None)
+    late = key in _OVER_BUDGET
+    _OVER_BUDGET.discard(key)
+    if task.cancelled() or task.exception() is not None or task.result() is None:
+        if not late:
+            _BREAKER.failure()
+    elif probe or not late:
+        _BREAKER.success()
+    if probe:
+        _BREAKER.end_probe()
+
+async def verify_turnstile(token: str, remote_ip: Optional[str] = None) -> bool:
+    return bool(await turnstile_verdict(token, remote_ip))
@@ -0,0 +1,87 @@
+﻿import os, time, httpx
+from typing import Dict
+from helpers import timing
+from helpers.metrics import UPSTREAM_LATENCY
+
+# One pooled AsyncClient per upstream host, opened/closed by the app lifespan.
+# Per-host overrides: UPSTREAM_<NAME>_MAX_CONNECTIONS, UPSTREAM_<NAME>_TIMEOUT, ...
+UPSTREAMS = {
+    "hibp": "https://haveibeenpwned.com",
+    "pwned": "https://api.pwnedpasswords.com",
+    "turnstile": "https://challenges.cloudflare.com",
+}
+
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "3"))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "20"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "10"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60"))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "1") != "0"
+
+try:
+    import h2  # noqa: F401  httpx only negotiates HTTP/2 when h2 is installed
+    _HAS_H2 = True
+except ImportError:
+    _HAS_H2 = False
+
+_CLIENTS: Dict[str, httpx.AsyncClient] = {}
+
+def _setting(name: str, key: str, default):
+    raw = os.getenv(f"UPSTREAM_{name.upper()}_{key}")
+    return type(default)(raw) if raw else default
+
+class _TimedTransport(httpx.AsyncBaseTransport):
+    # Records time-to-response-headers and status (or exception type) per upstream
+    def __init__(self, name: str, inner: httpx.AsyncBaseTransport):
+        self.name = name
+        self._inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        t0 = time.perf_counter()
+        try:
+            resp = await self._inner.handle_async_request(request)
+        except Exception as e:
+            self._observe(type(e).__name__, time.perf_counter() - t0)
+            raise
+        self._observe(str(resp.status_code), time.perf_counter() - t0)
+        return resp
+
+    def _observe(self, status: str, seconds: float) -> None:
+        UPSTREAM_LATENCY.labels(self.name, status).observe(seconds)
+        timing.record(f"upstream-{self.name}", seconds, status)
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+def _new_client(name: str) -> httpx.AsyncClient:
+    timeout = _setting(name, "TIMEOUT", UPSTREAM_TIMEOUT)
+    transport = httpx.AsyncHTTPTransport(
+        http2=UPSTREAM_HTTP2 and _HAS_H2,
+        limits=httpx.Limits(
+            max_connections=_setting(name, "MAX_CONNECTIONS", UPSTREAM_MAX_CONNECTIONS),
+            max_keepalive_connections=_setting(name, "MAX_KEEPALIVE", UPSTREAM_MAX_KEEPALIVE),
+            keepalive_expiry=_setting(name, "KEEPALIVE_EXPIRY", UPSTREAM_KEEPALIVE_EXPIRY),
+        ),
+    )
+    return httpx.AsyncClient(
+        base_url=UPSTREAMS.get(name, ""),
+        timeout=httpx.Timeout(timeout, connect=min(timeout, _setting(name, "CONNECT_TIMEOUT", UPSTREAM_CONNECT_TIMEOUT))),
+        transport=_TimedTransport(name, transport),
+    )
+
+def get_client(name: str) -> httpx.AsyncClient:
+    # Lazily (re)created so helpers still work outside the app lifespan (scripts, REPL).
+    client = _CLIENTS.get(name)
+    if client is None or client.is_closed:
+        client = _CLIENTS[name] = _new_client(name)
+    return client
+
+async def open_clients() -> None:
+    for name in UPSTREAMS:
+        get_client(name)
+
+async def close_clients() -> None:
+    clients = list(_CLIENTS.values())
+    _CLIENTS.clear()
+    for client in clients:
+        await client.aclose()
@@ -1,14 +1,27 @@
 ﻿from __future__ import annotations
 
-from typing import Optional, Dict, Deque, List
-from collections import deque
-from datetime import datetime, timedelta
-import hmac, hashlib, os
+from typing import Optional, List
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+import asyncio, hashlib, hmac, json, os, re, time
 
-from fastapi import FastAPI, Request, HTTPException
+import httpx
+from fastapi import Depends, FastAPI, Request, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr
-from starlette.responses import JSONResponse, Response
+from pydantic import BaseModel, EmailStr, Field, TypeAdapter, ValidationError
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+from helpers import archive, captcha, emails, exports, metrics, persist, pwned, rollups, storage, timing, upstream
+from helpers.hibp import HIBPBusy, HIBPNotConfigured, hibp_breaches, sync_domain
+from helpers.ihavepwned import load_dataset, lookup_email_async, normalize_email, watch_dataset
+from helpers.pwned import pwned_password_count
+from helpers.ratelimit import RateLimiter, make_backend
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "change-this-admin-token")
+# Bearer token for GET /metrics; unset leaves it open (keep it on an internal listener/network then)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Reverse proxies in front of the app that append to X-Forwarded-For (Render: 1); 0 = use the peer
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
 
 ALLOWED_ORIGINS = [
     "http://localhost:5173",
@@ -17,7 +30,29 @@ ALLOWED_ORIGINS = [
     "https://exposureshield.com",
 ]
 
-app = FastAPI(title="ExposureShield API", version="0.2.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pooled keep-alive clients for HIBP / Pwned Passwords / Turnstile live for the whole process
+    await upstream.open_clients()
+    await asyncio.to_thread(load_dataset)
+    await asyncio.to_thread(pwned.open_local)  # offline Pwned Passwords index, if configured
+    await asyncio.to_thread(storage.pool().open)  # runs pending schema migrations
+    persist.WRITER.start()
+    tasks = [asyncio.create_task(watch_dataset())]
+    if persist.STORE_MODE == "sqlite":
+        tasks.append(asyncio.create_task(archive.run_periodically()))
+    try:
+        yield
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await persist.WRITER.stop()  # flush queued scans/feedback before exit
+        storage.pool().close()
+        await upstream.close_clients()
+        metrics.mark_process_dead()
+
+app = FastAPI(title="ExposureShield API", version="0.2.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,6 +62,43 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    timings, token = timing.begin()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        # For streamed responses this is time to headers; the body is still to come
+        if timing.wants_header(request.headers.get(timing.OPT_IN_HEADER) == "1", is_admin(request)):
+            response.headers["Server-Timing"] = timings.header(time.perf_counter() - timings.start)
+            origin = request.headers.get("origin")
+            if origin in ALLOWED_ORIGINS:
+                response.headers["Timing-Allow-Origin"] = origin
+        return response
+    finally:
+        timing.end(token)
+        total = time.perf_counter() - timings.start
+        # Label by route template (/verify/domain/{domain}), never the raw path, to bound cardinality
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.REQUEST_LATENCY.labels(request.method, route, str(status)).observe(total)
+        if 0 <= timing.TIMING_LOG_MS <= total * 1000:
+            timings.log(request.method, route, status, total)
+
+@app.exception_handler(HIBPBusy)
+async def hibp_busy_handler(request: Request, exc: HIBPBusy):
+    # Shed load fast rather than queueing past what our HIBP plan can serve
+    retry = max(1, int(exc.retry_after + 0.999))
+    return JSONResponse(
+        {"detail": "Breach lookups are busy, try again shortly.", "retry_after": retry},
+        status_code=503,
+        headers={"Retry-After": str(retry)},
+    )
+
+@app.exception_handler(HIBPNotConfigured)
+async def hibp_not_configured_handler(request: Request, exc: HIBPNotConfigured):
+    return JSONResponse({"detail": "Breach lookups are not configured on this server."}, status_code=503)
+
 class ScanRequest(BaseModel):
     email: EmailStr
     password: str
@@ -38,14 +110,47 @@ class ScanResponse(BaseModel):
     advice: Optional[List[str]] = None
     has_exposure: Optional[bool] = None
     breaches: Optional[List[dict]] = None
+    pwned_count: Optional[int] = None
+    dataset_matches: Optional[int] = None
+    failed_sources: Optional[List[str]] = None
 
 class VerifyResponse(BaseModel):
     verified: bool
     breaches: List[dict]
 
+def client_ip(request: Request) -> str:
+    # Each proxy appends the address it saw, so only the rightmost TRUSTED_PROXY_HOPS entries are ours;
+    # anything to their left is whatever the client chose to send. A shorter header did not come through
+    # all of our proxies, so none of it can be trusted.
+    peer = request.client.host if request.client else "unknown"
+    if TRUSTED_PROXY_HOPS <= 0:
+        return peer
+    hops = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+    if len(hops) < TRUSTED_PROXY_HOPS:
+        return peer
+    return hops[-TRUSTED_PROXY_HOPS]
+
+def is_admin(request: Request) -> bool:
+    token = request.headers.get("X-Admin-Token")
+    return bool(token) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def require_admin(request: Request):
+    if not is_admin(request):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
 @app.get("/health")
 def health():
-    return {"status": "ok", "service": "exposureshield-api", "version": app.version}
+    return {"status": "ok", "service": "exposureshield-api", "version": app.version, "store": persist.STORE_MODE}
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics(request: Request):
+    if METRICS_TOKEN:
+        auth = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(auth.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+            raise HTTPException(status_code=401, detail="Unauthorized")
+    metrics.CAPTCHA_REPLAY_FILL.set(captcha.replay_fill())
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
 
 # OPTIONS handlers (some proxies are picky; this makes preflight always return 204)
 @app.options("/scan")
@@ -56,85 +161,289 @@ def scan_preflight():
 def verify_preflight():
     return Response(status_code=204)
 
+async def _dataset_lookup(email) -> List[dict]:
+    with timing.span("dataset"):
+        return await lookup_email_async(email)
+
 # Accept BOTH JSON and form-encoded bodies for /scan
 @app.post("/scan", response_model=ScanResponse)
 async def scan(request: Request):
     content_type = request.headers.get("content-type", "")
     if "application/json" in content_type:
-        data = await request.json()
-        sr = ScanRequest(**data)
+        with timing.span("parse", "json"):
+            data = await request.json()
+        with timing.span("validate"):
+            sr = ScanRequest(**data)
     else:
-        form = await request.form()
-        sr = ScanRequest(email=form.get("email", ""), password=form.get("password", ""))
+        with timing.span("parse", "form"):
+            form = await request.form()
+        with timing.span("validate"):
+            sr = ScanRequest(email=form.get("email", ""), password=form.get("password", ""))
 
-    advice = [
-        "Turn on 2FA for your email.",
-        "Update weak/reused passwords.",
-        "Use a password manager.",
-    ]
+    # Normalised once; the same object (with its digests cached on it) goes to every lookup
+    email = emails.normalize(sr.email)
+    matches, count, hb = await asyncio.gather(
+        _dataset_lookup(email),
+        pwned_password_count(sr.password),
+        hibp_breaches(email),
+        return_exceptions=True,
+    )
+    if isinstance(hb, HIBPBusy):
+        raise hb  # shed: 503 with the estimated wait (hibp_busy_handler), not a degraded result
+    # An upstream hiccup degrades the scan instead of failing it, but a source that was not
+    # checked must never read as clean: the scan is "partial" and names what failed
+    failed: List[str] = []
+    retryable = False  # a missing HIBP_API_KEY does not fix itself on a retry
+    for name, res in (("dataset", matches), ("pwned", count), ("hibp", hb)):
+        if isinstance(res, Exception):
+            if not isinstance(res, HIBPNotConfigured):
+                print(f"[WARN] scan {name} lookup failed: {res!r}")
+                retryable = True
+            failed.append(name)
+    hibp_off = isinstance(hb, HIBPNotConfigured)
+    matches = None if isinstance(matches, Exception) else matches
+    count = None if isinstance(count, Exception) else count
+    hb = None if isinstance(hb, Exception) else hb
 
-    demo_exposure = any(s in sr.email.lower() for s in ["eric", "test", "demo"])
+    exposed = bool(count) or bool(matches) or bool(hb)
+    if failed:
+        status = "partial"
+        has_exposure = True if exposed else None
+    else:
+        status = "exposure_found" if exposed else "no_exposure"
+        has_exposure = exposed
+    with timing.span("persist"):
+        await persist.persist_scan(email.scan_hash, status, client_ip(request))
+    advice: List[str] = []
+    if count:
+        advice.append(f"This password appears in {count:,} known breaches. Change it everywhere you use it.")
+    if matches:
+        advice.append("Your email appears in our local breach dataset. Update passwords and enable 2FA.")
+    if hb:
+        names = ", ".join(b.get("Name", "?") for b in hb[:5])
+        advice.append(f"Email found in {len(hb)} public breach(es) via HIBP: {names}. Change passwords and enable 2FA.")
+    if hibp_off:
+        advice.append("Public breach lookups (HIBP) are not enabled on this server, so this result does not include them.")
+    if retryable:
+        advice.append("Some checks could not be completed right now; scan again shortly for a full result.")
+    if not exposed:
+        advice += [
+            "Turn on 2FA for your email.",
+            "Update weak/reused passwords.",
+            "Use a password manager.",
+        ]
 
     return {
         "result": "success",
         "email": sr.email,
-        "status": "demo",
+        "status": status,
         "advice": advice,
-        "has_exposure": demo_exposure,
-        "breaches": [{"title": "Deezer", "domain": "deezer.com", "date": "2019-04-22", "data_classes": ["Email addresses", "Passwords"]}] if demo_exposure else [],
+        "has_exposure": has_exposure,
+        "breaches": None if hb is None else [map_breach(b) for b in hb],
+        "pwned_count": None if count is None else int(count),
+        "dataset_matches": None if matches is None else len(matches),
+        "failed_sources": failed or None,
+    }
+
+def map_breach(b: dict) -> dict:
+    return {
+        "name": b.get("Name"),
+        "title": b.get("Title"),
+        "domain": b.get("Domain"),
+        "date": b.get("BreachDate"),
+        "verified": bool(b.get("IsVerified", False)),
+        "pwn_count": b.get("PwnCount"),
+        "data_classes": b.get("DataClasses", []),
     }
 
 @app.get("/verify", response_model=VerifyResponse)
 async def verify(email: EmailStr):
-    has_exposure = "eric" in email.lower()
-    if has_exposure:
-        breaches = [
-            {
-                "name": "Deezer",
-                "title": "Deezer",
-                "domain": "deezer.com",
-                "date": "2019-04-22",
-                "verified": True,
-                "pwn_count": 229_037_936,
-                "data_classes": ["Email addresses", "Passwords"],
-            },
-            {
-                "name": "Canva",
-                "title": "Canva",
-                "domain": "canva.com",
-                "date": "2019-05-24",
-                "verified": True,
-                "pwn_count": 139_000_000,
-                "data_classes": ["Email addresses", "Names", "Passwords"],
-            },
-        ]
-    else:
-        breaches = []
-    return {"verified": True, "breaches": breaches}
+    try:
+        hb = await hibp_breaches(emails.normalize(email))
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=502, detail=f"HIBP error {e.response.status_code}")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"HIBP request failed: {e}")
+    return {"verified": True, "breaches": [map_breach(b) for b in hb]}
+
+# ---------- Admin metrics (daily rollups, selectable range) ----------
+@app.get("/admin/metrics")
+async def admin_metrics(request: Request, days: int = Query(7, ge=1, le=90)):
+    require_admin(request)
+    file_stores = None if persist.STORE_MODE == "sqlite" else persist.FILE_STORES
+    out = await asyncio.to_thread(rollups.metrics, days, file_stores)
+    # Per-process challenge counters plus the shared replay filter's occupancy
+    out["captcha"] = await asyncio.to_thread(captcha.stats)
+    return out
+
+# ---------- Admin exports (streamed in keyset batches; constant memory) ----------
+def _export(request: Request, table: str, fmt: str, since: Optional[str], until: Optional[str], gzip: bool):
+    require_admin(request)
+    if fmt not in exports.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(exports.FORMATS)}")
+    try:
+        t0, t1 = exports.parse_time(since), exports.parse_time(until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    file_store = None if persist.STORE_MODE == "sqlite" else persist.FILE_STORES[table]
+    filename = f"{table}.{fmt}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        exports.stream(table, fmt, t0, t1, file_store=file_store, gzip=gzip),
+        media_type="application/gzip" if gzip else exports.MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/admin/feedback/export")
+def export_feedback(request: Request, format: str = "csv", since: Optional[str] = None,
+                    until: Optional[str] = None, gzip: bool = False):
+    return _export(request, "feedback", format, since, until, gzip)
+
+@app.get("/admin/scans/export")
+def export_scans(request: Request, format: str = "csv", since: Optional[str] = None,
+                 until: Optional[str] = None, gzip: bool = False):
+    return _export(request, "scans", format, since, until, gzip)
+
+# ---------- Domain search (one breacheddomain call answers /verify for the whole domain) ----------
+_DOMAIN_RE = re.compile(r"^(?=.{1,253}$)([a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,63}$")
+
+@app.get("/verify/domain/{domain}")
+async def verify_domain(request: Request, domain: str, refresh: bool = Query(False)):
+    require_admin(request)
+    domain = domain.strip().lower()
+    if not _DOMAIN_RE.match(domain):
+        raise HTTPException(status_code=400, detail="Invalid domain")
+    try:
+        synced_at, mapping = await sync_domain(domain, force=refresh)
+    except httpx.HTTPStatusError as e:
+        code = e.response.status_code
+        detail = "HIBP refused the domain search (is the domain verified for this API key?)" if code in (401, 403) else f"HIBP error {code}"
+        raise HTTPException(status_code=502, detail=detail)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"HIBP request failed: {e}")
+    return {
+        "domain": domain,
+        "synced_at": datetime.fromtimestamp(synced_at, timezone.utc).isoformat(),
+        "breached_addresses": len(mapping),
+        "breaches": {f"{alias}@{domain}": names for alias, names in mapping.items()},
+    }
+
+# ---------- Bulk (NDJSON, one line per email as each completes) ----------
+# Bulk checks are for the admin token or a customer key from BATCH_API_KEYS (sent as X-API-Key),
+# limited per caller, and their HIBP calls queue behind interactive /scan and /verify lookups.
+BATCH_MAX = int(os.getenv("BATCH_MAX", "1000"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))
+BATCH_API_KEYS = [k.strip() for k in os.getenv("BATCH_API_KEYS", "").split(",") if k.strip()]
+BATCH_RATE_MAX = int(os.getenv("BATCH_RATE_MAX", "6"))
+BATCH_RATE_WINDOW_SEC = int(os.getenv("BATCH_RATE_WINDOW_SEC", "3600"))
+_EMAIL = TypeAdapter(EmailStr)
+
+batch_limiter = RateLimiter(BATCH_RATE_MAX, BATCH_RATE_WINDOW_SEC, backend=make_backend(max_keys=10_000), name="batch")
+
+def batch_caller(request: Request) -> str:
+    # Limiter key for the caller; never the raw key itself
+    if is_admin(request):
+        return "admin"
+    key = request.headers.get("X-API-Key", "").encode()
+    if key and any(hmac.compare_digest(key, k.encode()) for k in BATCH_API_KEYS):
+        return hashlib.sha256(key).hexdigest()[:16]
+    raise HTTPException(status_code=401, detail="Unauthorized")
+
+async def require_batch_quota(request: Request) -> None:
+    # Route dependency, so it runs before FastAPI validates the (up to BATCH_MAX addresses) body
+    wait = await batch_limiter.hit_async(batch_caller(request))
+    if wait:
+        raise HTTPException(status_code=429, detail="Batch limit reached, try again later.",
+                            headers={"Retry-After": str(max(1, int(wait + 0.999)))})
+
+class BatchRequest(BaseModel):
+    emails: List[str] = Field(..., min_length=1, max_length=BATCH_MAX)
+
+async def _scan_one(email: str) -> dict:
+    # Same partial shape as /scan: a failed HIBP lookup keeps the dataset matches and names the source
+    email = emails.normalize(email)
+    matches = await lookup_email_async(email)
+    out = {"email": str(email), "dataset_matches": len(matches)}
+    try:
+        hb = await hibp_breaches(email, batch=True)
+    except HIBPBusy as e:
+        out["retry_after"] = max(1, int(e.retry_after + 0.999))
+        hb = None
+    except (HIBPNotConfigured, httpx.HTTPError) as e:
+        if not isinstance(e, HIBPNotConfigured):
+            print(f"[WARN] batch scan hibp lookup failed: {e!r}")
+        hb = None
+    if hb is None:
+        out.update(status="partial", has_exposure=True if matches else None, breaches=None, failed_sources=["hibp"])
+        return out
+    exposed = bool(matches) or bool(hb)
+    out.update(status="exposure_found" if exposed else "no_exposure", has_exposure=exposed,
+               breaches=[map_breach(b) for b in hb])
+    return out
+
+async def _verify_one(email: str) -> dict:
+    hb = await hibp_breaches(email, batch=True)
+    return {"email": email, "verified": True, "breaches": [map_breach(b) for b in hb]}
+
+def _batch_stream(addresses: List[str], check) -> StreamingResponse:
+    seen, todo, invalid = set(), [], []
+    for raw in addresses:
+        e = normalize_email(raw)
+        if e in seen:
+            continue
+        seen.add(e)
+        try:
+            todo.append(_EMAIL.validate_python(e))
+        except ValidationError:
+            invalid.append(raw)
+
+    async def one(sem: asyncio.Semaphore, email: str) -> dict:
+        # Blanket error lines are for /verify/batch; _scan_one handles its own HIBP failures
+        async with sem:
+            try:
+                return await check(email)
+            except HIBPBusy as e:
+                return {"email": email, "error": "busy", "retry_after": max(1, int(e.retry_after + 0.999))}
+            except HIBPNotConfigured:
+                return {"email": email, "error": "not configured"}
+            except httpx.HTTPError as e:
+                return {"email": email, "error": f"upstream: {type(e).__name__}"}
+
+    async def body():
+        for raw in invalid:
+            yield json.dumps({"email": raw, "error": "invalid email"}) + "\n"
+        sem = asyncio.Semaphore(BATCH_CONCURRENCY)
+        tasks = [asyncio.create_task(one(sem, e)) for e in todo]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                yield json.dumps(await fut) + "\n"
+        finally:
+            # Client went away mid-stream: stop the remaining lookups
+            for t in tasks:
+                t.cancel()
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+@app.post("/scan/batch", dependencies=[Depends(require_batch_quota)])
+async def scan_batch(payload: BatchRequest):
+    return _batch_stream(payload.emails, _scan_one)
+
+@app.post("/verify/batch", dependencies=[Depends(require_batch_quota)])
+async def verify_batch(payload: BatchRequest):
+    return _batch_stream(payload.emails, _verify_one)
 
 # ---------- Feedback (captcha + rate-limit) ----------
-SECRET = os.getenv("FEEDBACK_SECRET", "dev-secret-change-me")
-CAPTCHA_TTL_SEC = 180
 RATE_LIMIT_WINDOW_SEC = 60
 RATE_LIMIT_MAX = 3
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
 
-recent: Dict[str, Deque[datetime]] = {}
-
-def sign_token(a: int, b: int, ts: int) -> str:
-    msg = f"{a}:{b}:{ts}".encode()
-    return hmac.new(SECRET.encode(), msg, hashlib.sha256).hexdigest()
-
-def verify_token(a: int, b: int, ts: int, tok: str) -> bool:
-    if abs(int(datetime.utcnow().timestamp()) - ts) > CAPTCHA_TTL_SEC:
-        return False
-    return hmac.compare_digest(sign_token(a, b, ts), tok)
+# RATE_LIMIT_BACKEND=shm|sqlite|redis shares the counters across uvicorn workers (see helpers/ratelimit.py)
+feedback_limiter = RateLimiter(RATE_LIMIT_MAX, RATE_LIMIT_WINDOW_SEC,
+                               backend=make_backend(max_keys=RATE_LIMIT_MAX_KEYS), name="feedback")
 
+# Stateless signed challenges with a shared spent-nonce filter (see helpers/captcha.py)
 @app.get("/feedback/captcha")
 def feedback_captcha():
-    from random import randint
-    a, b = randint(2, 9), randint(2, 9)
-    ts = int(datetime.utcnow().timestamp())
-    token = sign_token(a, b, ts)
+    a, b, ts, token = captcha.issue()
     return {"a": a, "b": b, "ts": ts, "token": token}
 
 class FeedbackIn(BaseModel):
@@ -148,20 +457,21 @@ class FeedbackIn(BaseModel):
 
 @app.post("/feedback")
 async def feedback(req: Request, payload: FeedbackIn):
-    ip = req.headers.get("x-forwarded-for", "").split(",")[0].strip() or (req.client.host if req.client else "unknown")
-    now = datetime.utcnow()
-    dq = recent.setdefault(ip, deque())
-    cutoff = now - timedelta(seconds=RATE_LIMIT_WINDOW_SEC)
-    while dq and dq[0] < cutoff:
-        dq.popleft()
-    if len(dq) >= RATE_LIMIT_MAX:
-        raise HTTPException(status_code=429, detail="Too many requests, try again later.")
-    dq.append(now)
-
-    if not verify_token(payload.a, payload.b, payload.ts, payload.token):
-        raise HTTPException(status_code=400, detail="Captcha expired/invalid.")
-    if payload.answer != (payload.a + payload.b):
+    timing.since_start("parse", "body+validation")
+    ip = client_ip(req)
+    with timing.span("ratelimit"):
+        wait = await feedback_limiter.hit_async(ip)
+    if wait:
+        raise HTTPException(status_code=429, detail="Too many requests, try again later.",
+                            headers={"Retry-After": str(max(1, int(wait + 0.999)))})
+
+    with timing.span("captcha"):
+        status = captcha.verify(payload.a, payload.b, payload.ts, payload.token, payload.answer)
+    if status == captcha.WRONG:
         raise HTTPException(status_code=400, detail="Captcha answer incorrect.")
+    if status != captcha.OK:
+        raise HTTPException(status_code=400, detail="Captcha expired/invalid.")
 
-    print(f"[FEEDBACK] {payload.email}: {payload.message}")
+    with timing.span("persist"):
+        await persist.persist_feedback(payload.email, payload.message, ip)
     return JSONResponse({"ok": True, "received": True})
@@ -0,0 +1,78 @@
+import hashlib, socketserver, threading
+from typing import Dict, Optional, Tuple
+
+from helpers.ratelimit import window_step
+
+class RespStub:
+    # Just enough of a Redis server for RedisBackend: AUTH, SELECT, SET [NX] (expiry ignored) and
+    # EVAL/EVALSHA of the limiter's sliding-window script. The first EVALSHA answers NOSCRIPT, like a
+    # fresh server. The script itself is NOT run here: EVAL answers with window_step in Python, so
+    # tests using the stub cover the client and protocol only. The Lua is checked against
+    # window_step by test_redis_script_matches_window_step (Lua 5.1 via lupa) and against a real
+    # server by test_redis_script_on_real_redis (REDIS_TEST_URL); both skip when unavailable.
+    def __init__(self, password: Optional[str] = None):
+        self.password = password
+        self.state: Dict[str, Tuple[int, int, int]] = {}
+        self.values: Dict[str, str] = {}
+        self.scripts = set()
+        self.commands = []
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                while True:
+                    args = stub._read_command(self.rfile)
+                    if args is None:
+                        return
+                    self.wfile.write(stub._dispatch(args))
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"redis://{':' + password + '@' if password else ''}127.0.0.1:{self._server.server_address[1]}/2"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    @staticmethod
+    def _read_command(rfile):
+        line = rfile.readline()
+        if not line:
+            return None
+        assert line[:1] == b"*", line
+        args = []
+        for _ in range(int(line[1:-2])):
+            n = int(rfile.readline()[1:-2])
+            args.append(rfile.read(n + 2)[:-2].decode())
+        return args
+
+    def _dispatch(self, args) -> bytes:
+        cmd = args[0].upper()
+        self.commands.append(cmd)
+        if cmd == "AUTH":
+            return b"+OK\r\n" if args[1] == self.password else b"-WRONGPASS invalid password\r\n"
+        if cmd == "SELECT":
+            return b"+OK\r\n"
+        if cmd == "SET":
+            if "NX" in (a.upper() for a in args[3:]) and args[1] in self.values:
+                return b"$-1\r\n"
+            self.values[args[1]] = args[2]
+            return b"+OK\r\n"
+        if cmd == "EVALSHA" and args[1] not in self.scripts:
+            return b"-NOSCRIPT No matching script.\r\n"
+        if cmd == "EVAL":
+            self.scripts.add(hashlib.sha1(args[1].encode()).hexdigest())
+        if cmd in ("EVAL", "EVALSHA"):
+            nkeys = int(args[2])
+            keys, (now, limit, window) = args[3:3 + nkeys], map(float, args[3 + nkeys:6 + nkeys])
+            out = []
+            for key in keys:
+                *state, wait = window_step(*self.state.get(key, (0, 0, 0)), int(limit), window, now)
+                if wait > 0:
+                    out.append(repr(wait))
+                else:
+                    self.state[key] = tuple(state)
+                    out.append("0")
+            return b"*%d\r\n" % len(out) + b"".join(b"$%d\r\n%s\r\n" % (len(v), v.encode()) for v in out)
+        return b"-ERR unknown command\r\n"
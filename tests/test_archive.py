@@ -0,0 +1,93 @@
+import hashlib, os, time
+
+import pytest
+
+from helpers import archive
+from helpers.archive import ArchiveFile, write_file
+
+def _cols(n, hashes=None, ips=None):
+    ids = [10 + i * 3 for i in range(n)]
+    return {
+        "id": ids,
+        # created_at is not monotonic in id order (write-behind batches), so deltas go negative
+        "created_at": [1_700_000_000 + (i * 7919) % 500 for i in range(n)],
+        "email_hash": hashes or [hashlib.sha256(str(i).encode()).hexdigest() for i in range(n)],
+        "status": ["exposure_found" if i % 3 == 0 else "no_exposure" for i in range(n)],
+        "ip": ips or [f"10.0.{i % 7}.{i % 5}" for i in range(n)],
+    }
+
+def test_round_trip(tmp_path):
+    cols = _cols(1000)
+    path = tmp_path / "scans-a.col"
+    write_file(path, cols)
+    f = ArchiveFile(path)
+    assert f.header["rows"] == 1000
+    assert (f.header["min_id"], f.header["max_id"]) == (10, cols["id"][-1])
+    assert f.header["email_hash"] == "hex32"
+    assert f.columns(list(cols)) == cols
+
+def test_partial_column_read(tmp_path):
+    cols = _cols(50)
+    path = tmp_path / "scans-b.col"
+    write_file(path, cols)
+    out = ArchiveFile(path).columns(("created_at", "status"))
+    assert set(out) == {"created_at", "status"}
+    assert out["created_at"] == cols["created_at"] and out["status"] == cols["status"]
+
+def test_text_hashes_and_wide_dictionaries(tmp_path):
+    # Non-sha256 values fall back to text; >65535 distinct ips need 32-bit dictionary codes
+    n = 70_000
+    hashes = ["legacy-" + str(i) if i % 2 else hashlib.sha256(str(i).encode()).hexdigest() for i in range(n)]
+    ips = [f"10.{i >> 16}.{(i >> 8) & 255}.{i & 255}" for i in range(n)]
+    cols = _cols(n, hashes=hashes, ips=ips)
+    path = tmp_path / "scans-c.col"
+    write_file(path, cols)
+    f = ArchiveFile(path)
+    assert f.header["email_hash"] == "text"
+    assert f.header["typecodes"]["ip"] == "I" and f.header["typecodes"]["status"] == "H"
+    assert f.columns(list(cols)) == cols
+
+def test_write_leaves_no_tmp_and_rejects_foreign_files(tmp_path):
+    path = tmp_path / "scans-d.col"
+    write_file(path, _cols(3))
+    assert [p.name for p in tmp_path.iterdir()] == ["scans-d.col"]
+    junk = tmp_path / "junk.col"
+    junk.write_bytes(b"x" * 64)
+    with pytest.raises(ValueError):
+        ArchiveFile(junk)
+
+@pytest.mark.skipif(archive.fcntl is None, reason="needs fcntl")
+def test_only_one_compactor(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", tmp_path)
+    first = archive._try_lock()
+    assert first is not None
+    try:
+        assert archive._try_lock() is None
+    finally:
+        os.close(first)
+    second = archive._try_lock()
+    assert second is not None
+    os.close(second)
+
+def test_orphan_cleanup_includes_tmp(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", tmp_path)
+
+    class _Con:
+        def execute(self, sql):
+            return [("listed.col",)]
+
+    class _Reader:
+        def __enter__(self):
+            return _Con()
+
+        def __exit__(self, *exc):
+            return False
+
+    monkeypatch.setattr(archive.storage, "reader", lambda: _Reader())
+    old = time.time() - archive._ORPHAN_GRACE_SEC - 10
+    for name in ("listed.col", "orphan.col", "scans-x.col.123.tmp", "fresh.col.456.tmp"):
+        (tmp_path / name).write_bytes(b"")
+    for name in ("listed.col", "orphan.col", "scans-x.col.123.tmp"):
+        os.utime(tmp_path / name, (old, old))
+    archive._remove_orphans()
+    assert sorted(p.name for p in tmp_path.glob("*.*")) == ["fresh.col.456.tmp", "listed.col"]
@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+from helpers import captcha
+from tests.resp_stub import RespStub
+
+@pytest.fixture
+def redis_stub():
+    stub = RespStub()
+    yield stub
+    stub.close()
+
+def _replica(tmp_path, name, url):
+    # One replica: its own host-local filter file, the shared Redis
+    return captcha._RedisReplay(url, captcha._ReplayFilter(1000, str(tmp_path / name)))
+
+def test_local_filter_catches_replays(tmp_path):
+    f = captcha._ReplayFilter(1000, str(tmp_path / "replay"))
+    now = time.time()
+    assert f.spend(b"n1", now)
+    assert not f.spend(b"n1", now)
+    assert f.spend(b"n2", now)
+
+def test_redis_replay_is_shared_across_replicas(tmp_path, redis_stub):
+    a, b = _replica(tmp_path, "a", redis_stub.url), _replica(tmp_path, "b", redis_stub.url)
+    now = time.time()
+    assert a.spend(b"n1", now)
+    assert not b.spend(b"n1", now)
+    assert b.spend(b"n2", now)
+
+def test_redis_failure_falls_back_to_local_filter(tmp_path):
+    r = _replica(tmp_path, "a", "redis://127.0.0.1:1/0")
+    now = time.time()
+    assert r.spend(b"n1", now)
+    assert not r.spend(b"n1", now)
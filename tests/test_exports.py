@@ -0,0 +1,43 @@
+import asyncio, json
+
+import pytest
+
+from helpers import exports, storage
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    pool = storage.Pool(tmp_path / "exports.db")
+    monkeypatch.setattr(storage, "_POOL", pool)
+    monkeypatch.setattr(exports, "EXPORT_BATCH", 100)
+    # created_at is only roughly ordered by id, as with write-behind batches
+    rows = [(f"h{i}", "no_exposure", "10.0.0.1", 1_700_000_000 + i * 10 + (i * 7919) % 50) for i in range(2000)]
+    with pool.writer() as con:
+        con.executemany("INSERT INTO scans (email_hash, status, ip, created_at) VALUES (?, ?, ?, ?)", rows)
+        con.commit()
+    yield rows
+    pool.close()
+
+def _export(**kw):
+    async def run():
+        return b"".join([chunk async for chunk in exports.stream("scans", "ndjson", **kw)])
+    return [json.loads(line) for line in asyncio.run(run()).decode().splitlines()]
+
+def test_time_range_export_matches_filter(db):
+    since, until = 1_700_012_000, 1_700_015_000
+    got = _export(since=since, until=until)
+    want = [r[0] for r in db if since <= r[3] < until]
+    assert [r["email_hash"] for r in got] == want
+
+def test_time_range_is_seeded_from_the_index(db):
+    since, until = 1_700_012_000, 1_700_015_000
+    max_id, after, upper = exports._id_range("scans", since, until)
+    ids = [i + 1 for i, r in enumerate(db) if since <= r[3] < until]
+    assert max_id == len(db)
+    assert (after, upper) == (ids[0] - 1, ids[-1])
+    with storage.reader() as con:
+        plan = con.execute("EXPLAIN QUERY PLAN SELECT MIN(+id) FROM scans WHERE created_at >= ?", (since,)).fetchall()
+    assert "idx_scans_created_at" in plan[0][-1]
+
+def test_empty_range(db):
+    assert _export(since=1_800_000_000) == []
+    assert exports._id_range("scans", None, 1_000)[2] == 0
@@ -0,0 +1,52 @@
+import json
+from datetime import datetime, timezone
+
+from helpers.filestore import SegmentStore
+
+T0 = 1_700_000_000  # 2023-11-14 22:13:20 UTC
+
+def _rec(i, ts, note=""):
+    return {"email_hash": f"h{i}", "note": note, "created_at": datetime.fromtimestamp(ts, timezone.utc).isoformat()}
+
+class _CountingFile:
+    # Wraps the segment handle to count what reaches the OS; tell() is deliberately absent
+    def __init__(self, f):
+        self.f, self.flushes = f, 0
+
+    def write(self, s):
+        return self.f.write(s)
+
+    def flush(self):
+        self.flushes += 1
+        self.f.flush()
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        self.f.close()
+
+def test_batch_is_flushed_once(tmp_path):
+    store = SegmentStore("scans", root=tmp_path)
+    store.append([_rec(0, T0)], [T0])
+    store._f = counting = _CountingFile(store._f)
+    store.append([_rec(i, T0) for i in range(1, 200)], [T0] * 199)
+    assert counting.flushes == 1
+    assert store._size == store._path.stat().st_size
+    store.close()
+
+def test_rotates_on_utf8_size_and_day(tmp_path):
+    store = SegmentStore("scans", root=tmp_path)
+    store.max_bytes = 1000
+    # Multi-byte text: a character count would undercount the segment size
+    recs = [_rec(i, T0, "é" * 40) for i in range(30)]
+    store.append(recs, [T0] * 30)
+    store.append([_rec(30, T0 + 86400)], [T0 + 86400])
+    store.close()
+    segs = sorted(tmp_path.glob("scans/*.ndjson"))
+    sizes = [p.stat().st_size for p in segs]
+    line = len((json.dumps(recs[0], ensure_ascii=False) + "\n").encode())
+    assert all(s < 1000 + line for s in sizes)
+    assert len(segs) > 2 and "-20231115-" in segs[-1].name
+    sidecars = [json.loads(p.with_name(p.name + ".idx.json").read_text()) for p in segs]
+    assert sum(s["rows"] for s in sidecars) == 31
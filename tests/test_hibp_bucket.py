@@ -0,0 +1,68 @@
+import asyncio, time
+
+import httpx
+import pytest
+
+from helpers import hibp
+
+def test_interactive_lookup_sheds_on_long_wait(monkeypatch):
+    monkeypatch.setattr(hibp, "HIBP_MAX_WAIT_SEC", 5)
+    bucket = hibp._TokenBucket(1 / 6, 1)  # 10 per minute
+
+    async def run():
+        await bucket.acquire()
+        t0 = time.monotonic()
+        with pytest.raises(hibp.HIBPBusy) as e:
+            await bucket.acquire()
+        return time.monotonic() - t0, e.value.retry_after
+
+    elapsed, retry_after = asyncio.run(run())
+    assert elapsed < 0.1
+    assert 5 < retry_after <= 6
+
+def test_batch_lookup_sheds_on_long_wait(monkeypatch):
+    monkeypatch.setattr(hibp, "HIBP_BATCH_MAX_WAIT_SEC", 5)
+    bucket = hibp._TokenBucket(1 / 6, 1)
+
+    async def run():
+        await bucket.acquire(batch=True)
+        with pytest.raises(hibp.HIBPBusy):
+            await bucket.acquire(batch=True)
+
+    asyncio.run(run())
+
+def test_short_wait_is_queued(monkeypatch):
+    monkeypatch.setattr(hibp, "HIBP_MAX_WAIT_SEC", 5)
+    bucket = hibp._TokenBucket(20, 1)
+
+    async def run():
+        await asyncio.gather(*(bucket.acquire() for _ in range(3)))
+
+    asyncio.run(run())
+
+def test_domain_sync_honours_retry_after(monkeypatch):
+    # Both the breacheddomain and the /breaches catalog call go through the bucket's 429 handling
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if calls.count(request.url.path) == 1:
+            return httpx.Response(429, headers={"Retry-After": "0.2"})
+        if "breacheddomain" in request.url.path:
+            return httpx.Response(200, json={"alice": ["Adobe"]})
+        return httpx.Response(200, json=[{"Name": "Adobe"}])
+
+    stored = []
+    monkeypatch.setattr(hibp, "KEY", "k")
+    monkeypatch.setattr(hibp, "_BUCKET", hibp._TokenBucket(1000, 10))
+    monkeypatch.setattr(hibp, "get_client", lambda name: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(hibp, "_domain_rows", lambda domain: (0, {}))
+    monkeypatch.setattr(hibp, "_catalog_missing", lambda names: True)
+    monkeypatch.setattr(hibp, "_store_domain", lambda *args: stored.append(args))
+
+    t0 = time.monotonic()
+    _, mapping = asyncio.run(hibp.sync_domain("example.com"))
+    assert mapping == {"alice": ["Adobe"]}
+    assert stored == [("example.com", {"alice": ["Adobe"]}, [{"Name": "Adobe"}])]
+    assert len(calls) == 4
+    assert time.monotonic() - t0 >= 0.4  # paused for each Retry-After
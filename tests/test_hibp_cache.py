@@ -0,0 +1,61 @@
+import asyncio, sqlite3, time
+
+import pytest
+
+from helpers import hibp, storage
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    pool = storage.Pool(tmp_path / "hibp.db")
+    monkeypatch.setattr(storage, "_POOL", pool)
+    monkeypatch.setattr(hibp, "_MEM", type(hibp._MEM)())
+    monkeypatch.setattr(hibp, "HIBP_CACHE_DB", True)
+    monkeypatch.setattr(hibp, "_DB_WRITES", 0)
+    yield pool
+    pool.close()
+
+def _db_expiry(key):
+    with storage.reader() as con:
+        row = con.execute("SELECT expires_at FROM hibp_cache WHERE key = ?", (key,)).fetchone()
+    return row and row[0]
+
+def test_hits_and_negatives_have_their_own_ttl(cache):
+    now = time.time()
+    asyncio.run(hibp._cache_put("hit", [{"Name": "Adobe"}]))
+    asyncio.run(hibp._cache_put("miss", []))
+    assert hibp._MEM["hit"][0] == pytest.approx(now + hibp.HIBP_CACHE_TTL, abs=2)
+    assert hibp._MEM["miss"][0] == pytest.approx(now + hibp.HIBP_CACHE_NEG_TTL, abs=2)
+    assert _db_expiry("hit") == pytest.approx(now + hibp.HIBP_CACHE_TTL, abs=2)
+    assert _db_expiry("miss") == pytest.approx(now + hibp.HIBP_CACHE_NEG_TTL, abs=2)
+
+def test_db_tier_serves_other_workers(cache):
+    asyncio.run(hibp._cache_put("k", [{"Name": "Adobe"}]))
+    hibp._MEM.clear()  # another worker: empty in-process tier, same database
+    assert asyncio.run(hibp._cache_get("k")) == [{"Name": "Adobe"}]
+    assert "k" in hibp._MEM
+
+def test_expired_entries_are_misses(cache):
+    hibp._mem_put("k", time.time() - 1, [{"Name": "Adobe"}])
+    hibp._db_put("k", time.time() - 1, [{"Name": "Adobe"}])
+    assert asyncio.run(hibp._cache_get("k")) is None
+    assert "k" not in hibp._MEM
+
+def test_expired_rows_are_purged_every_256_writes(cache):
+    past = time.time() - 10
+    for i in range(255):
+        hibp._db_put(f"old{i}", past, [])
+    with storage.reader() as con:
+        assert con.execute("SELECT COUNT(*) FROM hibp_cache").fetchone()[0] == 255
+    hibp._db_put("fresh", time.time() + 60, [])  # 256th write purges
+    with storage.reader() as con:
+        assert con.execute("SELECT key FROM hibp_cache").fetchall() == [("fresh",)]
+
+def test_sqlite_failures_fall_back_to_memory(cache, monkeypatch):
+    def broken(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(hibp, "_db_get", broken)
+    monkeypatch.setattr(hibp, "_db_put", broken)
+    asyncio.run(hibp._cache_put("k", [{"Name": "Adobe"}]))  # write failure is logged, not raised
+    assert asyncio.run(hibp._cache_get("k")) == [{"Name": "Adobe"}]
+    assert asyncio.run(hibp._cache_get("other")) is None  # read failure is a miss
@@ -0,0 +1,63 @@
+import io, json, sqlite3
+
+import pytest
+
+from helpers import ihavepwned
+
+ROWS = [
+    {"email": "Alice@Example.com", "breach": "Adobe", "data": ["Emails", "Passwords"], "note": "brace } and [ in text"},
+    {"email": "bob@example.com", "breach": "Canva", "data": [], "note": "unicode é ✓"},
+    {"email": "alice@example.com", "breach": "Dropbox", "data": ["Emails"], "note": "\"quoted\", comma"},
+]
+
+def _doc(rows=ROWS):
+    return json.dumps({"meta": {"breaches_note": "x"}, "breaches": rows}, ensure_ascii=False, indent=1)
+
+@pytest.mark.parametrize("chunk", [1, 7, 64, 1 << 16])
+def test_objects_split_across_chunks(monkeypatch, chunk):
+    monkeypatch.setattr(ihavepwned, "_CHUNK", chunk)
+    assert list(ihavepwned._iter_json_array(io.StringIO(_doc()))) == ROWS
+
+def test_object_straddles_default_chunk_boundary():
+    # A padding row sized so the second row starts a few bytes before the 64 KB boundary
+    pad = {"email": "pad@example.com", "note": ""}
+    rows = [pad, *ROWS]
+    start = json.dumps({"breaches": rows}, ensure_ascii=False).index('{"email": "Alice')
+    pad["note"] = "p" * (ihavepwned._CHUNK - 10 - start)
+    text = json.dumps({"breaches": rows}, ensure_ascii=False)
+    assert text.index('{"email": "Alice') < ihavepwned._CHUNK < text.index('"Adobe"')
+    assert list(ihavepwned._iter_json_array(io.StringIO(text))) == rows
+
+def test_missing_key_and_empty_array():
+    assert list(ihavepwned._iter_json_array(io.StringIO('{"other": []}'))) == []
+    assert list(ihavepwned._iter_json_array(io.StringIO('{"breaches": [ ]}'))) == []
+
+def test_truncated_file_raises(monkeypatch):
+    monkeypatch.setattr(ihavepwned, "_CHUNK", 16)
+    with pytest.raises(json.JSONDecodeError):
+        list(ihavepwned._iter_json_array(io.StringIO(_doc()[:-30])))
+
+def test_bom_input(tmp_path):
+    src = tmp_path / "data.json"
+    src.write_bytes(b"\xef\xbb\xbf" + _doc().encode())
+    nd = tmp_path / "data.ndjson"
+    nd.write_bytes(b"\xef\xbb\xbf" + "\n".join(json.dumps(r, ensure_ascii=False) for r in ROWS).encode() + b"\n\n")
+    assert list(ihavepwned.iter_breaches(str(src))) == ROWS
+    assert list(ihavepwned.iter_breaches(str(nd))) == ROWS
+
+@pytest.mark.parametrize("suffix", [".db", ".ndjson"])
+def test_convert_round_trip(tmp_path, suffix):
+    src = tmp_path / "data.json"
+    src.write_text(_doc(), encoding="utf-8")
+    dst = tmp_path / "out" / f"data{suffix}"
+    assert ihavepwned.convert(str(src), str(dst)) == 3
+    assert not dst.with_suffix(dst.suffix + ".tmp").exists()
+    ds = ihavepwned._build(str(dst))
+    assert ds.rows == 3
+    alice = ds.lookup("alice@example.com")
+    assert sorted(r["breach"] for r in alice) == ["Adobe", "Dropbox"]
+    assert ds.lookup("bob@example.com") == [{"email": "bob@example.com", **{k: v for k, v in ROWS[1].items() if k != "email"}}]
+    assert ds.lookup("carol@example.com") == []
+    if suffix == ".db":
+        with sqlite3.connect(dst) as con:
+            assert con.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall() == [("idx_breaches_email",)]
@@ -0,0 +1,105 @@
+import sqlite3, threading, time
+
+import pytest
+
+from helpers import migrations
+
+# Tables as the pre-versioning app created them (user_version 0, ISO-8601 text timestamps)
+_LEGACY = """
+CREATE TABLE feedback (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  email TEXT NOT NULL,
+  message TEXT NOT NULL,
+  ip TEXT NOT NULL,
+  created_at TEXT NOT NULL
+);
+CREATE TABLE scans (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  email_hash TEXT NOT NULL,
+  status TEXT NOT NULL,
+  ip TEXT NOT NULL,
+  created_at TEXT NOT NULL
+);
+INSERT INTO scans (id, email_hash, status, ip, created_at) VALUES
+  (1, 'h1', 'no_exposure', '1.1.1.1', '2025-11-01T10:00:00'),
+  (2, 'h2', 'exposure_found', '1.1.1.2', '2025-11-01T23:59:59+00:00'),
+  (5, 'h3', 'no_exposure', '1.1.1.3', '2025-11-02T00:30:00Z'),
+  (6, 'h4', 'no_exposure', '1.1.1.4', 'not a date');
+INSERT INTO feedback (id, email, message, ip, created_at) VALUES
+  (1, 'a@example.com', 'hi', '1.1.1.1', '2025-11-02T12:00:00+02:00');
+"""
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    path = tmp_path / "legacy.db"
+    con = sqlite3.connect(path)
+    con.executescript(_LEGACY)
+    con.commit()
+    yield path, con
+    con.close()
+
+def _tables(con):
+    return {n for (n,) in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+def test_upgrade_from_v0(legacy_db):
+    _, con = legacy_db
+    assert migrations.current_version(con) == 0
+    assert migrations.migrate(con) == migrations.LATEST == 5
+    assert {"scans", "feedback", "hibp_cache", "daily_counts", "archive_files"} <= _tables(con)
+    rows = con.execute("SELECT id, created_at, typeof(created_at) FROM scans ORDER BY id").fetchall()
+    assert rows == [(1, 1761991200, "integer"), (2, 1762041599, "integer"),
+                    (5, 1762043400, "integer"), (6, 0, "integer")]
+    assert con.execute("SELECT created_at FROM feedback").fetchone() == (1762077600,)
+    # ids and AUTOINCREMENT survive the table rebuild
+    con.execute("INSERT INTO scans (email_hash, status, ip, created_at) VALUES ('h5', 's', 'ip', 1)")
+    assert con.execute("SELECT MAX(id) FROM scans").fetchone() == (7,)
+    counts = dict(((k, d), n) for k, d, n in con.execute("SELECT kind, day, n FROM daily_counts"))
+    assert counts[("scans", "2025-11-01")] == 2
+    assert counts[("scans", "2025-11-02")] == 1
+    assert counts[("feedback", "2025-11-02")] == 1
+    indexes = {n for (n,) in con.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"idx_scans_created_at", "idx_scans_email_hash", "idx_feedback_created_at"} <= indexes
+
+def test_fresh_database_and_idempotence(tmp_path):
+    con = sqlite3.connect(tmp_path / "fresh.db")
+    assert migrations.migrate(con) == migrations.LATEST
+    assert migrations.migrate(con) == migrations.LATEST
+    assert con.execute("SELECT COUNT(*) FROM scans").fetchone() == (0,)
+    con.close()
+
+def test_busy_timeout_restored(legacy_db):
+    _, con = legacy_db
+    con.execute("PRAGMA busy_timeout = 1234")
+    migrations.migrate(con)
+    assert con.execute("PRAGMA busy_timeout").fetchone() == (1234,)
+
+def test_concurrent_worker_waits_for_migration(legacy_db, monkeypatch):
+    # A second worker with a short pool timeout must queue behind a slow step, not fail
+    path, con = legacy_db
+    con.close()
+    original = migrations.MIGRATIONS[1]
+
+    def slow_step(c):
+        time.sleep(0.5)
+        original[2](c)
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", [migrations.MIGRATIONS[0], (2, original[1], slow_step),
+                                                    *migrations.MIGRATIONS[2:]])
+    results, errors = [], []
+
+    def worker():
+        c = sqlite3.connect(path, timeout=0.05, check_same_thread=False)
+        try:
+            results.append(migrations.migrate(c))
+        except sqlite3.Error as e:
+            errors.append(e)
+        finally:
+            c.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert results == [migrations.LATEST] * 3
@@ -0,0 +1,90 @@
+import asyncio, json
+
+import pytest
+
+from helpers import persist
+from helpers.filestore import SegmentStore
+from helpers.metrics import PERSISTED_ROWS
+
+@pytest.fixture
+def batches(monkeypatch):
+    # Replaces the store: records each batch the writer hands over
+    seen = []
+
+    def write(batch):
+        seen.append(list(batch))
+        return "written"
+
+    monkeypatch.setattr(persist, "write_batch", write)
+    return seen
+
+def _row(i):
+    return ("scans", (f"h{i}", "no_exposure", "10.0.0.1", 1_700_000_000 + i))
+
+def test_flush_on_size(batches):
+    async def run():
+        w = persist.WriteBehind(batch_max=3, flush_sec=30)
+        w.start()
+        for i in range(3):
+            await w.put(*_row(i))
+        await asyncio.wait_for(_until(lambda: batches), 2)
+        await w.stop()
+
+    asyncio.run(run())
+    assert [len(b) for b in batches] == [3]
+
+def test_flush_on_time(batches):
+    async def run():
+        w = persist.WriteBehind(batch_max=100, flush_sec=0.05)
+        w.start()
+        await w.put(*_row(0))
+        await w.put(*_row(1))
+        await asyncio.wait_for(_until(lambda: batches), 2)
+        flushed = [len(b) for b in batches]
+        await w.stop()
+        return flushed
+
+    assert asyncio.run(run()) == [2]
+
+def test_flush_on_stop(batches):
+    async def run():
+        w = persist.WriteBehind(batch_max=100, flush_sec=30)
+        w.start()
+        for i in range(5):
+            await w.put(*_row(i))
+        await asyncio.sleep(0.05)
+        assert batches == []
+        await w.stop()
+
+    asyncio.run(run())
+    assert sum(len(b) for b in batches) == 5
+
+def test_no_writer_writes_through(batches):
+    asyncio.run(persist.WriteBehind().put(*_row(0)))
+    assert batches == [[_row(0)]]
+
+def test_failed_sqlite_batch_falls_back_to_file(tmp_path, monkeypatch):
+    def locked(groups):
+        raise RuntimeError("database is locked")
+
+    stores = {kind: SegmentStore(kind, root=tmp_path) for kind in persist.COLUMNS}
+    monkeypatch.setattr(persist, "STORE_MODE", "sqlite")
+    monkeypatch.setattr(persist, "_write_sqlite", locked)
+    monkeypatch.setattr(persist, "FILE_STORES", stores)
+    before = PERSISTED_ROWS.labels("scans", "fallback")._value.get()
+
+    async def run():
+        w = persist.WriteBehind(batch_max=2, flush_sec=30)
+        w.start()
+        await w.put(*_row(0))
+        await w.put(*_row(1))
+        await w.stop()
+
+    asyncio.run(run())
+    rows = [json.loads(line) for p in sorted(tmp_path.glob("scans/*.ndjson")) for line in p.read_text().splitlines()]
+    assert [r["email_hash"] for r in rows] == ["h0", "h1"]
+    assert PERSISTED_ROWS.labels("scans", "fallback")._value.get() == before + 2
+
+async def _until(pred):
+    while not pred():
+        await asyncio.sleep(0.005)
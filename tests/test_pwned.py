@@ -0,0 +1,68 @@
+import asyncio, hashlib
+
+import httpx
+import pytest
+
+from helpers import pwned
+
+def _suffix(pw: str) -> str:
+    return hashlib.sha1(pw.encode()).hexdigest().upper()[5:]
+
+@pytest.fixture
+def upstream(monkeypatch):
+    # Mocked range API: "<suffix>:<count>" lines plus zero-count padding rows, counting fetches per prefix
+    fetches = []
+
+    async def handler(request):
+        prefix = request.url.path.rsplit("/", 1)[1]
+        fetches.append(prefix)
+        await asyncio.sleep(0.01)
+        lines = [f"{'0' * 35}:4", f"{_suffix('password')}:9545824", f"{'F' * 35}:7", f"{'A' * 35}:0"]
+        return httpx.Response(200, text="\r\n".join(lines))
+
+    monkeypatch.setattr(pwned, "get_client", lambda name: httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(pwned, "_LOCAL", None)
+    monkeypatch.setattr(pwned, "PWNED_LOCAL_PATH", "")
+    monkeypatch.setattr(pwned, "_CACHE", type(pwned._CACHE)())
+    monkeypatch.setattr(pwned, "_INFLIGHT", {})
+    return fetches
+
+def test_range_parse_and_search():
+    rng = pwned._Range(f"{'F' * 35}:7\r\n{'1' * 35}:2\r\n{'0' * 35}:4\r\n{'A' * 35}:0\r\nnot-a-row\r\n")
+    assert len(rng.keys) == 3 * pwned._KEY_WIDTH  # padding row and junk dropped, 18 bytes per key
+    assert list(rng.counts) == [4, 2, 7]  # sorted by suffix
+    assert rng.count("0" * 35) == 4  # first
+    assert rng.count("F" * 35) == 7  # last
+    assert rng.count("1" * 35) == 2
+    assert rng.count("A" * 35) == 0  # padding rows never match
+    assert rng.count("2" * 35) == 0
+
+def test_password_count_via_range(upstream):
+    assert asyncio.run(pwned.pwned_password_count("password")) == 9545824
+    assert upstream == [hashlib.sha1(b"password").hexdigest().upper()[:5]]
+
+def test_concurrent_lookups_share_one_fetch(upstream):
+    async def run():
+        return await asyncio.gather(*(pwned.pwned_password_count("password") for _ in range(10)))
+
+    assert asyncio.run(run()) == [9545824] * 10
+    assert len(upstream) == 1
+    assert pwned._INFLIGHT == {}
+
+def test_cache_ttl_and_lru(upstream, monkeypatch):
+    monkeypatch.setattr(pwned, "_MAX", 2)
+
+    async def run(prefixes):
+        for p in prefixes:
+            await pwned._get_range(p)
+
+    asyncio.run(run(["AAAAA", "BBBBB", "AAAAA"]))  # second AAAAA is a hit
+    assert upstream == ["AAAAA", "BBBBB"]
+    asyncio.run(run(["CCCCC"]))  # evicts BBBBB, the least recently used
+    assert list(pwned._CACHE) == ["AAAAA", "CCCCC"]
+    asyncio.run(run(["BBBBB"]))
+    assert upstream[-1] == "BBBBB"
+    expires, rng = pwned._CACHE["CCCCC"]
+    pwned._CACHE["CCCCC"] = (expires - pwned._TTL - 1, rng)  # past its TTL
+    asyncio.run(run(["CCCCC"]))
+    assert upstream[-1] == "CCCCC" and len(upstream) == 5
@@ -0,0 +1,64 @@
+import hashlib
+
+import pytest
+
+from helpers import pwned
+from helpers.pwned_local import PwnedIndex, build
+
+def _sha1(pw: str) -> bytes:
+    return hashlib.sha1(pw.encode()).digest()
+
+@pytest.fixture
+def index(tmp_path):
+    words = {"password": 9545824, "123456": 37359195, "letmein": 1000, "hunter2": 17}
+    lines = [f"{_sha1(w).hex().upper()}:{n}" for w, n in words.items()]
+    lines.append(f"{_sha1('letmein').hex().upper()}:5")  # duplicates are summed
+    lines.append(f"{'F' * 40}:3")  # last prefix slot
+    lines.append(f"{'0' * 40}:2")  # first prefix slot
+    src = tmp_path / "dump.txt"
+    src.write_text("\r\n".join(lines) + "\r\n\r\n")
+    dst = tmp_path / "out" / "pwned.bin"
+    assert build(str(src), str(dst)) == 6
+    idx = PwnedIndex(str(dst))
+    yield idx
+    idx.close()
+
+def test_counts_round_trip(index):
+    assert index.count(_sha1("password")) == 9545824
+    assert index.count(_sha1("123456")) == 37359195
+    assert index.count(_sha1("hunter2")) == 17
+    assert index.count(_sha1("letmein")) == 1005
+    assert index.count(b"\xff" * 20) == 3
+    assert index.count(b"\x00" * 20) == 2
+    assert index.size == 6
+
+def test_missing_hashes_count_zero(index):
+    assert index.count(_sha1("correct horse battery staple")) == 0
+    # Same 5-hex-char prefix as a present hash, different tail
+    near = bytearray(_sha1("password"))
+    near[-1] ^= 1
+    assert index.count(bytes(near)) == 0
+
+def test_rejects_foreign_file(tmp_path):
+    p = tmp_path / "junk.bin"
+    p.write_bytes(b"NOTMAGIC" + bytes(64))
+    with pytest.raises(ValueError):
+        PwnedIndex(str(p))
+
+def test_rejects_malformed_line(tmp_path):
+    src = tmp_path / "bad.txt"
+    src.write_text("ABCDEF:12\n")
+    with pytest.raises(ValueError):
+        build(str(src), str(tmp_path / "bad.bin"))
+
+def test_failed_open_is_cached(tmp_path, monkeypatch):
+    bogus = tmp_path / "foreign.bin"
+    bogus.write_bytes(b"NOTPWNED" + b"\0" * 64)
+    monkeypatch.setattr(pwned, "PWNED_LOCAL_PATH", str(bogus))
+    monkeypatch.setattr(pwned, "_LOCAL", None)
+    monkeypatch.setattr(pwned, "_LOCAL_ERROR", None)
+    with pytest.raises(ValueError):
+        pwned.open_local()
+    bogus.unlink()  # a retry would now raise FileNotFoundError; the first failure is kept instead
+    with pytest.raises(ValueError):
+        pwned.open_local()
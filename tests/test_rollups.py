@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+from helpers import archive, persist, rollups, storage
+
+DAY = 86400
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    pool = storage.Pool(tmp_path / "rollups.db")
+    monkeypatch.setattr(storage, "_POOL", pool)
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", tmp_path / "archive")
+    yield pool
+    pool.close()
+
+def _daily(kind):
+    with storage.reader() as con:
+        return dict(con.execute("SELECT day, n FROM daily_counts WHERE kind = ?", (kind,)))
+
+def _recount(table):
+    with storage.reader() as con:
+        return dict(con.execute(
+            f"SELECT date(created_at, 'unixepoch'), COUNT(*) FROM {table} GROUP BY 1"))
+
+def _insert(now):
+    # Several write-behind batches spanning old (archivable) and recent days, with UTC midnight edges
+    scans = [(f"h{i}", "no_exposure", "10.0.0.1", now - (i % 200) * DAY - i % 3) for i in range(1000)]
+    feedback = [(f"u{i}@example.com", "hi", "10.0.0.1", now - (i % 5) * DAY) for i in range(20)]
+    for i in range(0, len(scans), 300):
+        persist._write_sqlite({"scans": scans[i:i + 300], "feedback": feedback[i // 300 * 5:i // 300 * 5 + 5]})
+    return scans
+
+def test_bump_matches_inserted_rows(db):
+    now = (int(time.time()) // DAY) * DAY  # UTC midnight: rows land exactly on day boundaries
+    _insert(now)
+    assert _daily("scans") == _recount("scans")
+    assert _daily("feedback") == _recount("feedback")
+    m = rollups.metrics(7)
+    assert m["totals"] == {"scans": 1000, "feedback": 20}
+    assert m["series"]["scans"] == [_recount("scans").get(d, 0) for d in m["series"]["dates"]]
+
+def test_backfill_reproduces_counts_after_compaction(db):
+    _insert(int(time.time()))
+    before = {"scans": _daily("scans"), "feedback": _daily("feedback")}
+    moved = archive.compact(after_days=90, file_rows=100)
+    assert moved > 0
+    with storage.writer() as con:
+        with con:
+            con.execute("DELETE FROM daily_counts")
+    assert rollups.main(["backfill"]) == 0
+    assert {"scans": _daily("scans"), "feedback": _daily("feedback")} == before
@@ -0,0 +1,41 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from helpers import timing
+
+# No context manager: the lifespan (DB, upstream clients) is not needed for /health
+client = TestClient(main.app)
+ADMIN = {"X-Admin-Token": main.ADMIN_TOKEN}
+OPT_IN = {timing.OPT_IN_HEADER: "1"}
+
+def _header(headers):
+    return client.get("/health", headers=headers).headers.get("Server-Timing")
+
+@pytest.mark.parametrize("mode, admin, opted_in, public", [
+    ("off", False, False, False),
+    ("admin", True, False, False),
+    ("on", True, True, False),
+])
+def test_header_per_mode(monkeypatch, mode, admin, opted_in, public):
+    monkeypatch.setattr(timing, "SERVER_TIMING", mode)
+    assert (_header(ADMIN) is not None) is admin
+    assert (_header(OPT_IN) is not None) is opted_in
+    assert (_header({}) is not None) is public
+
+def test_opt_in_needs_exact_value_and_valid_token(monkeypatch):
+    monkeypatch.setattr(timing, "SERVER_TIMING", "on")
+    assert _header({timing.OPT_IN_HEADER: "true"}) is None
+    monkeypatch.setattr(timing, "SERVER_TIMING", "admin")
+    assert _header({"X-Admin-Token": main.ADMIN_TOKEN + "x", **OPT_IN}) is None
+
+def test_header_lists_spans():
+    t, token = timing.begin()
+    try:
+        with timing.span("hibp") as s:
+            s.desc = "hit"
+        timing.record("db", 0.0125)
+    finally:
+        timing.end(token)
+    timing.record("outside", 1.0)  # no collector: ignored
+    assert t.header(0.5) == 'hibp;desc="hit";dur=' + f"{t.spans[0][1] * 1000:.1f}" + ", db;dur=12.5, total;dur=500.0"
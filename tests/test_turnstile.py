@@ -0,0 +1,98 @@
+import asyncio
+
+import httpx
+import pytest
+
+from helpers import turnstile, upstream
+
+@pytest.fixture
+def siteverify(monkeypatch):
+    # Mock Cloudflare: every call answers `success` after `delay` seconds
+    calls = {"n": 0, "delay": 0.0, "success": True}
+
+    async def handler(request):
+        calls["n"] += 1
+        await asyncio.sleep(calls["delay"])
+        return httpx.Response(200, json={"success": calls["success"]})
+
+    monkeypatch.setenv("TURNSTILE_SECRET_KEY", "secret")
+    monkeypatch.setattr(turnstile, "_BREAKER", turnstile._Breaker(3, 60))
+    monkeypatch.setattr(turnstile, "_VERDICTS", type(turnstile._VERDICTS)())
+    monkeypatch.setattr(turnstile, "_INFLIGHT", {})
+    monkeypatch.setattr(turnstile, "_OVER_BUDGET", set())
+    upstream._CLIENTS["turnstile"] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    yield calls
+    upstream._CLIENTS.pop("turnstile", None)
+
+def test_slow_siteverify_opens_breaker(siteverify, monkeypatch):
+    monkeypatch.setattr(turnstile, "TURNSTILE_BUDGET_SEC", 0.05)
+    siteverify["delay"] = 0.2
+
+    async def run():
+        verdicts = []
+        for i in range(8):
+            verdicts.append(await turnstile.turnstile_verdict(f"tok{i}"))
+            await asyncio.sleep(0.25)  # let the late answer land before the next call
+        return verdicts
+
+    assert asyncio.run(run()) == [None] * 8
+    assert turnstile._BREAKER.state == "open"
+    # Once open, callers skip Cloudflare instead of waiting out the budget
+    assert siteverify["n"] == 3
+
+def test_success_is_single_use(siteverify):
+    async def run():
+        first = await turnstile.turnstile_verdict("tok")
+        again = await turnstile.turnstile_verdict("tok")
+        return first, again
+
+    assert asyncio.run(run()) == (True, False)
+    assert siteverify["n"] == 1
+
+def test_coalesced_callers_share_one_success(siteverify):
+    siteverify["delay"] = 0.05
+
+    async def run():
+        return await asyncio.gather(*(turnstile.turnstile_verdict("tok") for _ in range(3)))
+
+    assert sorted(asyncio.run(run())) == [False, False, True]
+    assert siteverify["n"] == 1
+
+def test_late_success_serves_one_retry(siteverify, monkeypatch):
+    monkeypatch.setattr(turnstile, "TURNSTILE_BUDGET_SEC", 0.05)
+    siteverify["delay"] = 0.1
+
+    async def run():
+        first = await turnstile.turnstile_verdict("tok")
+        await asyncio.sleep(0.1)
+        return first, await turnstile.turnstile_verdict("tok"), await turnstile.turnstile_verdict("tok")
+
+    assert asyncio.run(run()) == (None, True, False)
+    assert turnstile._BREAKER.failures == 1
+
+def test_failure_verdict_is_cached(siteverify):
+    siteverify["success"] = False
+
+    async def run():
+        return [await turnstile.turnstile_verdict("tok") for _ in range(3)]
+
+    assert asyncio.run(run()) == [False, False, False]
+    assert siteverify["n"] == 1
+
+def test_timed_out_probe_stays_in_flight(siteverify, monkeypatch):
+    monkeypatch.setattr(turnstile, "TURNSTILE_BUDGET_SEC", 0.05)
+    breaker = turnstile._BREAKER = turnstile._Breaker(3, 0.0)  # half-open again as soon as it re-opens
+    breaker.failures = 3
+    siteverify["delay"] = 0.2
+
+    async def run():
+        probe = await turnstile.turnstile_verdict("tok0")
+        # The owner gave up but the probe is still running: no second probe until it settles
+        during = [await turnstile.turnstile_verdict(f"tok{i}") for i in range(1, 4)]
+        await asyncio.sleep(0.25)
+        return probe, during
+
+    assert asyncio.run(run()) == (None, [None] * 3)
+    assert siteverify["n"] == 1
+    # The late probe answer was a success, so the breaker closes
+    assert breaker.state == "closed"